@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+benchmark suite for the personal data redaction path:
+filter_datum, RedactingFormatter and the users export
+"""
+
+from argparse import ArgumentParser
+from typing import Callable, Dict, List
+import io
+import json
+import logging
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+from filtered_logger import (PII_FIELDS, RedactingFormatter,
+                             export_users, filter_datum)
+
+USER_COLUMNS = ('name', 'email', 'phone', 'ssn', 'password',
+                'ip', 'last_login', 'user_agent')
+
+
+def make_fields(count: int) -> List[str]:
+    """
+    returns count field names, PII ones first
+    """
+    extra = ["field{}".format(i) for i in range(max(0, count - 5))]
+    return (list(PII_FIELDS) + extra)[:count]
+
+
+def make_message(fields: List[str], matching: int, length: int,
+                 separator: str) -> str:
+    """
+    builds a key=value message of about length characters
+    in which the first matching fields are present
+    """
+    pairs = ["{}=value{}{}".format(f, i, separator)
+             for i, f in enumerate(fields[:matching])]
+    i = 0
+    while sum(len(p) for p in pairs) < length:
+        pairs.append("other{}=filler{}{}".format(i, i, separator))
+        i += 1
+    return ''.join(pairs)
+
+
+def create_users_db(path: str, rows: int, seed: int = 0) -> None:
+    """
+    fills a SQLite users table with synthetic rows
+    """
+    rng = random.Random(seed)
+    db = sqlite3.connect(path)
+    db.execute("DROP TABLE IF EXISTS users;")
+    db.execute("CREATE TABLE users ({});".format(
+        ", ".join("{} TEXT".format(c) for c in USER_COLUMNS)))
+    db.executemany(
+        "INSERT INTO users VALUES (?, ?, ?, ?, ?, ?, ?, ?);",
+        (("User {}".format(i), "user{}@example.com".format(i),
+          "({:03d}) {:03d}-{:04d}".format(rng.randrange(1000),
+                                          rng.randrange(1000),
+                                          rng.randrange(10000)),
+          "{:03d}-{:02d}-{:04d}".format(rng.randrange(1000),
+                                        rng.randrange(100),
+                                        rng.randrange(10000)),
+          "pw{:08x}".format(rng.getrandbits(32)),
+          "10.{}.{}.{}".format(rng.randrange(256), rng.randrange(256),
+                               rng.randrange(256)),
+          "2019-11-14 {:02d}:{:02d}:{:02d}".format(i // 3600 % 24,
+                                                   i // 60 % 60, i % 60),
+          "Mozilla/5.0 (X11; Linux x86_64)") for i in range(rows)))
+    db.commit()
+    db.close()
+
+
+def measure(name: str, op: Callable[[], None], iterations: int,
+            units: int = 1, **params) -> Dict:
+    """
+    times op iterations times and returns ops/sec
+    with p50/p99 latencies in microseconds
+    """
+    op()
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter_ns()
+        op()
+        samples.append(time.perf_counter_ns() - start)
+    samples.sort()
+    total = sum(samples)
+    return {
+        "name": name,
+        "params": params,
+        "iterations": iterations,
+        "ops_per_sec": units * iterations * 1e9 / total if total else 0.0,
+        "p50_us": samples[len(samples) // 2] / 1e3,
+        "p99_us": samples[min(len(samples) - 1,
+                              int(len(samples) * 0.99))] / 1e3,
+    }
+
+
+def bench_filter_datum(iterations: int) -> List[Dict]:
+    """
+    filter_datum across field count, message length,
+    number of matching fields and separator
+    """
+    results = []
+    for count in (1, 5, 20):
+        fields = make_fields(count)
+        for length in (64, 1024):
+            for matching in sorted({0, count // 2, count}):
+                for separator in (';', '|'):
+                    message = make_message(fields, matching, length,
+                                           separator)
+                    results.append(measure(
+                        "filter_datum",
+                        lambda: filter_datum(fields, "***", message,
+                                             separator),
+                        iterations, fields=count, length=len(message),
+                        matching=matching, separator=separator))
+    return results
+
+
+def bench_formatter(iterations: int) -> List[Dict]:
+    """
+    RedactingFormatter.format on key=value and mapping messages
+    """
+    formatter = RedactingFormatter(list(PII_FIELDS))
+    fields = make_fields(len(PII_FIELDS))
+    results = []
+    for length in (64, 1024):
+        message = make_message(fields, len(fields), length, ';')
+        results.append(measure(
+            "formatter",
+            lambda: formatter.format(logging.LogRecord(
+                "user_data", logging.INFO, None, None, message, None, None)),
+            iterations, kind="text", length=len(message)))
+    payload = {f: "value" for f in fields}
+    payload.update({"other{}".format(i): i for i in range(10)})
+    results.append(measure(
+        "formatter",
+        lambda: formatter.format(logging.LogRecord(
+            "user_data", logging.INFO, None, None, payload, None, None)),
+        iterations, kind="mapping", keys=len(payload)))
+    return results
+
+
+def bench_export(rows: int, repeats: int) -> List[Dict]:
+    """
+    the legacy per-row logger loop of main() against export_users
+    """
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    try:
+        create_users_db(path, rows)
+        db = sqlite3.connect(path)
+
+        def legacy():
+            sink = io.StringIO()
+            handler = logging.StreamHandler(sink)
+            handler.setFormatter(RedactingFormatter(list(PII_FIELDS)))
+            logger = logging.Logger("user_data_bench")
+            logger.addHandler(handler)
+            cursor = db.cursor()
+            cursor.execute("SELECT * FROM users;")
+            field_names = [i[0] for i in cursor.description]
+            for row in cursor:
+                str_row = ''.join(f'{f}={str(r)}; '
+                                  for r, f in zip(row, field_names))
+                logger.info(str_row.strip())
+            cursor.close()
+
+        results = [measure("export", legacy, repeats, rows,
+                           mode="legacy", rows=rows)]
+        for batch_size in (100, 1000, 10000):
+            results.append(measure(
+                "export",
+                lambda: export_users(db, io.StringIO(), batch_size),
+                repeats, rows, mode="streaming", rows=rows,
+                batch_size=batch_size))
+        db.close()
+        return results
+    finally:
+        os.remove(path)
+
+
+def main(argv: List[str] = None) -> None:
+    """
+    run the suite and print a table, optionally writing JSON
+    """
+    parser = ArgumentParser(description="Benchmark PII redaction")
+    parser.add_argument("-n", "--iterations", type=int, default=2000)
+    parser.add_argument("-r", "--rows", type=int, default=20000,
+                        help="synthetic users for the export benchmark")
+    parser.add_argument("--repeats", type=int, default=5,
+                        help="runs of each export case")
+    parser.add_argument("--json", metavar="PATH",
+                        help="write results as JSON ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    results = (bench_filter_datum(args.iterations) +
+               bench_formatter(args.iterations) +
+               bench_export(args.rows, args.repeats))
+
+    out = sys.stderr if args.json == "-" else sys.stdout
+    for r in results:
+        params = " ".join("{}={}".format(k, v)
+                          for k, v in r["params"].items())
+        out.write("{:<13} {:<55} {:>14,.0f} ops/s  p50 {:>10.1f}us  "
+                  "p99 {:>10.1f}us\n".format(r["name"], params,
+                                             r["ops_per_sec"], r["p50_us"],
+                                             r["p99_us"]))
+    if args.json == "-":
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    elif args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
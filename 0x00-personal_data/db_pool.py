@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+module that keeps a pool of reusable
+database connections
+"""
+
+from collections import deque
+from typing import Any, Callable
+import threading
+import time
+
+
+class PooledConnection():
+    """ Connection proxy whose close() hands the
+    connection back to its pool instead of closing it
+    """
+
+    def __init__(self, pool: 'ConnectionPool', connection: Any):
+        """
+        initialize arguments
+        """
+        self._pool = pool
+        self._connection = connection
+
+    def __getattr__(self, name: str) -> Any:
+        """
+        delegate everything else to the wrapped connection
+        """
+        if self._connection is None:
+            raise AttributeError("connection already returned to the pool")
+        return getattr(self._connection, name)
+
+    def close(self) -> None:
+        """
+        return the connection to the pool
+        """
+        if self._connection is not None:
+            self._pool.release(self._connection)
+            self._connection = None
+
+    def __enter__(self) -> 'PooledConnection':
+        """
+        use the connection in a with block
+        """
+        return self
+
+    def __exit__(self, *exc) -> None:
+        """
+        return the connection when the with block ends
+        """
+        self.close()
+
+
+class ConnectionPool():
+    """ Bounded pool of connections built by factory,
+    health checked on checkout and dropped once idle too long
+    """
+
+    def __init__(self, factory: Callable[[], Any], size: int = 5,
+                 idle_timeout: float = 300.0, timeout: float = None):
+        """
+        initialize arguments; at most size connections are checked
+        out at once and connect() waits up to timeout seconds
+        (forever when None) for one to be released
+        """
+        if size < 1:
+            raise ValueError("size must be at least 1")
+        self.factory = factory
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def connect(self) -> PooledConnection:
+        """
+        check out a healthy connection, reusing an idle one
+        when possible and opening a new one otherwise
+        """
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError("no connection available in the pool")
+        try:
+            while True:
+                with self._lock:
+                    self._evict_idle()
+                    if not self._idle:
+                        break
+                    connection, _ = self._idle.pop()
+                if self.is_healthy(connection):
+                    return PooledConnection(self, connection)
+                self._discard(connection)
+            return PooledConnection(self, self.factory())
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, connection: Any) -> None:
+        """
+        put a connection back in the pool, discarding
+        it if its transaction cannot be rolled back
+        """
+        try:
+            connection.rollback()
+        except Exception:
+            self._discard(connection)
+        else:
+            with self._lock:
+                self._idle.append((connection, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    def close(self) -> None:
+        """
+        close every idle connection
+        """
+        with self._lock:
+            idle, self._idle = self._idle, deque()
+        for connection, _ in idle:
+            self._discard(connection)
+
+    @staticmethod
+    def is_healthy(connection: Any) -> bool:
+        """
+        checks that a connection still talks to the server
+        """
+        try:
+            if hasattr(connection, 'ping'):
+                connection.ping(reconnect=False)
+            else:
+                cursor = connection.cursor()
+                cursor.execute("SELECT 1;")
+                cursor.fetchall()
+                cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def _evict_idle(self) -> None:
+        """
+        drop connections idle longer than idle_timeout; the
+        oldest sit at the left since checkout pops from the right
+        """
+        if self.idle_timeout is None:
+            return
+        deadline = time.monotonic() - self.idle_timeout
+        while self._idle and self._idle[0][1] < deadline:
+            self._discard(self._idle.popleft()[0])
+
+    @staticmethod
+    def _discard(connection: Any) -> None:
+        """
+        close a connection, ignoring errors from dead ones
+        """
+        try:
+            connection.close()
+        except Exception:
+            pass
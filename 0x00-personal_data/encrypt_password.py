@@ -5,29 +5,182 @@ encrypting passwords using
 bcrypt
 """
 
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from os import environ
+from typing import Callable, List, Tuple, Union
+import atexit
+import threading
+import time
+
 import bcrypt
 
+from hash_service import HashService
+
+MIN_ROUNDS = 4
+MAX_ROUNDS = 31
+
 
-def hash_password(password: str) -> bytes:
+def bcrypt_rounds() -> int:
+    """
+    returns the bcrypt cost configured in
+    PERSONAL_DATA_BCRYPT_ROUNDS, 15 when unset
+    """
+    rounds = int(environ.get("PERSONAL_DATA_BCRYPT_ROUNDS", 15))
+    if not MIN_ROUNDS <= rounds <= MAX_ROUNDS:
+        raise ValueError("bcrypt rounds must be between {} and {}".format(
+            MIN_ROUNDS, MAX_ROUNDS))
+    return rounds
+
+
+def hash_password(password: str, rounds: int = None) -> bytes:
     """
     expects one string argument name password
     and returns a salted, hashed password,
     which is a byte string.
     """
 
+    if rounds is None:
+        rounds = bcrypt_rounds()
     encrypt = password.encode()
-    hashed_pwd = bcrypt.hashpw(encrypt, bcrypt.gensalt(15))
+    hashed_pwd = bcrypt.hashpw(encrypt, bcrypt.gensalt(rounds))
     return hashed_pwd
 
 
-def is_valid(hashed_password: bytes, password: str) -> bool:
+def hash_rounds(hashed_password: Union[bytes, str]) -> int:
+    """
+    returns the bcrypt cost a hash was made with,
+    read from its $2b$<cost>$ prefix
+    """
+    if isinstance(hashed_password, str):
+        hashed_password = hashed_password.encode()
+    return int(hashed_password.split(b"$")[2])
+
+
+def needs_rehash(hashed_password: Union[bytes, str]) -> bool:
+    """
+    tells whether a hash was made with a cost
+    other than the configured one
+    """
+    return hash_rounds(hashed_password) != bcrypt_rounds()
+
+
+def _rehash(hashed_password: bytes, password: str,
+            on_rehash: Callable[[bytes, bytes], None]) -> None:
+    """
+    hashes password at the current cost and hands the old
+    and new hashes to on_rehash
+    """
+    try:
+        on_rehash(hashed_password, hash_password(password))
+    finally:
+        _rehash_slots.release()
+
+
+_rehash_queue = ThreadPoolExecutor(max_workers=1,
+                                   thread_name_prefix="rehash")
+# queued rehashes hold plaintext passwords: at most
+# PERSONAL_DATA_REHASH_QUEUE of them, the others are dropped
+_rehash_slots = threading.BoundedSemaphore(
+    int(environ.get("PERSONAL_DATA_REHASH_QUEUE", 100)))
+
+
+def is_valid(hashed_password: bytes, password: str,
+             on_rehash: Callable[[bytes, bytes], None] = None) -> bool:
     """
      function that expects 2 arguments and returns a boolean.
      Uses bcrypt to validate that the provided password matches
      the hashed password.
+
+     when the password matches a hash made with another cost
+     than the configured one and on_rehash is given, a new hash
+     is computed on a background thread and passed to on_rehash
+     after the old one, so the caller can store it only if the
+     stored hash is still the old one (a password reset may have
+     landed in between). Rehashes are dropped while the queue is
+     full; a later login retries them
     """
     valid = False
     encrypt = password.encode()
     if bcrypt.checkpw(encrypt, hashed_password):
         valid = True
+    if valid and on_rehash is not None and needs_rehash(hashed_password) \
+            and _rehash_slots.acquire(blocking=False):
+        _rehash_queue.submit(_rehash, hashed_password, password, on_rehash)
     return valid
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def hash_service() -> HashService:
+    """
+    returns the shared process pool running hash_password
+    and is_valid, sized by PERSONAL_DATA_HASH_WORKERS and
+    bounded by PERSONAL_DATA_HASH_QUEUE pending calls
+    """
+    global _service
+    with _service_lock:
+        if _service is None:
+            workers = int(environ.get("PERSONAL_DATA_HASH_WORKERS", 0))
+            pending = int(environ.get("PERSONAL_DATA_HASH_QUEUE", 0))
+            _service = HashService(hash_password, is_valid,
+                                   workers or None, pending or None)
+            atexit.register(_service.shutdown)
+        return _service
+
+
+def time_rounds(rounds: int, samples: int = 3) -> float:
+    """
+    returns the median seconds one hash takes at a bcrypt cost
+    """
+    timings = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        bcrypt.hashpw(b"calibration password", bcrypt.gensalt(rounds))
+        timings.append(time.perf_counter() - start)
+    return sorted(timings)[len(timings) // 2]
+
+
+def calibrate(target_ms: float = 250.0, samples: int = 3,
+              max_rounds: int = MAX_ROUNDS
+              ) -> Tuple[int, List[Tuple[int, float]]]:
+    """
+    finds the highest bcrypt cost whose hash time stays within
+    target_ms on this machine; returns it with the measured
+    (rounds, milliseconds) pairs. Each extra round doubles the
+    cost, so measuring stops at the first one over budget
+    """
+    best = MIN_ROUNDS
+    timings = []
+    for rounds in range(MIN_ROUNDS, max_rounds + 1):
+        elapsed = time_rounds(rounds, samples) * 1000
+        timings.append((rounds, elapsed))
+        if elapsed > target_ms:
+            break
+        best = rounds
+    return best, timings
+
+
+def main(argv: List[str] = None) -> None:
+    """
+    print the measured time per bcrypt cost
+    and the cost that fits the latency budget
+    """
+    parser = ArgumentParser(description="Calibrate the bcrypt cost")
+    parser.add_argument("-t", "--target-ms", type=float, default=250.0,
+                        help="latency budget per hash in milliseconds")
+    parser.add_argument("-s", "--samples", type=int, default=3,
+                        help="hashes timed per cost")
+    parser.add_argument("-m", "--max-rounds", type=int, default=MAX_ROUNDS)
+    args = parser.parse_args(argv)
+
+    best, timings = calibrate(args.target_ms, args.samples, args.max_rounds)
+    for rounds, elapsed in timings:
+        print("rounds={:<3} {:>10.1f} ms".format(rounds, elapsed))
+    print("PERSONAL_DATA_BCRYPT_ROUNDS={}".format(best))
+
+
+if __name__ == "__main__":
+    main()
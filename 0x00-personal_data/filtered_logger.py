@@ -4,13 +4,58 @@ function called filter_datum
 that returns the log message obfuscated:
 """
 
-from typing import List
+from functools import lru_cache
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, List, Mapping, Pattern, TextIO, Tuple
+import atexit
+import copy
+import json
+import os
 import re
 import logging
+import queue
+import sqlite3
+import sys
+import threading
 from os import environ
 import mysql.connector
 
+from db_pool import ConnectionPool, PooledConnection
+
 PII_FIELDS = ('email', 'phone', 'ssn', 'password', 'name')
+OVERLOAD_POLICIES = ('block', 'drop')
+CHECKPOINT_FILE = ".export_checkpoint.json"
+RECORD_ATTRIBUTES = frozenset(vars(logging.makeLogRecord({}))) | {
+    'message', 'asctime', '_redacted'}
+
+
+@lru_cache(maxsize=128)
+def redaction_pattern(fields: Tuple[str, ...], separator: str) -> Pattern:
+    """
+    compiles a single alternation pattern matching
+    every `field=value<separator>` pair in one pass,
+    cached per (fields, separator) tuple
+    """
+    alternation = '|'.join(re.escape(field) for field in fields)
+    return re.compile(f"({alternation})=.*?{re.escape(separator)}")
+
+
+@lru_cache(maxsize=128)
+def redaction_template(redaction: str, separator: str) -> str:
+    """
+    builds the substitution template that keeps the
+    matched field name and swaps its value for redaction
+    """
+    tail = f"{redaction}{separator}".replace('\\', '\\\\')
+    return f"\\g<1>={tail}"
+
+
+def redact(pattern: Pattern, template: str, message: str) -> str:
+    """
+    redacts every field matched by a compiled
+    pattern in a single scan of the message
+    """
+    return pattern.sub(template, message)
 
 
 def filter_datum(
@@ -20,10 +65,10 @@ def filter_datum(
     uses regex to redact sensitve
     information from a log message
     """
-    for i in fields:
-        message = re.sub(f"{i}=.*?{separator}",
-                         f"{i}={redaction}{separator}", message)
-    return message
+    if not fields:
+        return message
+    return redact(redaction_pattern(tuple(fields), separator),
+                  redaction_template(redaction, separator), message)
 
 
 class RedactingFormatter(logging.Formatter):
@@ -40,31 +85,285 @@ class RedactingFormatter(logging.Formatter):
         """
         super(RedactingFormatter, self).__init__(self.FORMAT)
         self.fields = fields
+        self._keys = frozenset(fields)
+        self._cache_key = (tuple(fields), self.REDACTION)
+        self._pattern = redaction_pattern(tuple(fields), self.SEPARATOR)
+        self._template = redaction_template(self.REDACTION, self.SEPARATOR)
+
+    def redact_structure(self, value: Any) -> Any:
+        """
+        returns a copy of a mapping or list with the value
+        of every PII key replaced, found by key set lookup
+        """
+        if isinstance(value, Mapping):
+            return {k: self.REDACTION if k in self._keys
+                    else self.redact_structure(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [self.redact_structure(v) for v in value]
+        return value
+
+    def redact_message(self, record: logging.LogRecord) -> str:
+        """
+        redacts the message: mappings and JSON payloads
+        structurally, anything else as key=value; pairs
+        """
+        if isinstance(record.msg, Mapping):
+            return json.dumps(self.redact_structure(record.msg), default=str)
+        message = record.getMessage()
+        if message[:1] in ('{', '['):
+            try:
+                payload = json.loads(message)
+            except ValueError:
+                pass
+            else:
+                return json.dumps(self.redact_structure(payload))
+        if not self.fields:
+            return message
+        return redact(self._pattern, self._template, message)
+
+    def redacted(self, record: logging.LogRecord) -> dict:
+        """
+        returns the redacted message and `extra` attributes of a record,
+        cached on the record so each handler reuses the same result
+        """
+        cache = record.__dict__.get('_redacted')
+        if cache is None:
+            cache = record._redacted = {}
+        result = cache.get(self._cache_key)
+        if result is not None:
+            return result
+
+        result = {'message': self.redact_message(record)}
+        for key, value in record.__dict__.items():
+            if key in RECORD_ATTRIBUTES:
+                continue
+            if key in self._keys:
+                result[key] = self.REDACTION
+            elif isinstance(value, (Mapping, list, tuple)):
+                result[key] = self.redact_structure(value)
+        cache[self._cache_key] = result
+        return result
 
     def format(self, record: logging.LogRecord) -> str:
         """
         format records by redacting sensitive info
+        without mutating the record itself
+        """
+        view = copy.copy(record)
+        view.__dict__.update(self.redacted(record))
+        view.msg = view.message
+        view.args = None
+        return super(RedactingFormatter, self).format(view)
+
+
+class BatchStreamHandler(logging.StreamHandler):
+    """ Stream handler that buffers formatted lines
+    and writes them to the stream in one call on flush
+    """
+
+    def __init__(self, stream=None, capacity: int = 512):
+        """
+        initialize arguments
+        """
+        super(BatchStreamHandler, self).__init__(stream)
+        self.capacity = capacity
+        self.buffer = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        """
+        format the record into the buffer, writing
+        it out once the buffer reaches capacity
+        """
+        try:
+            self.buffer.append(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+        if len(self.buffer) >= self.capacity:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        write every buffered line to the stream at once; when the
+        stream fails the lines are dropped and the error goes to
+        handleError like any other emit error
+        """
+        self.acquire()
+        try:
+            lines = len(self.buffer)
+            if self.buffer and self.stream is not None:
+                self.stream.write(''.join(self.buffer))
+            if self.stream is not None and hasattr(self.stream, "flush"):
+                self.stream.flush()
+        except Exception:
+            self.handleError(logging.makeLogRecord({
+                "msg": "dropped %d buffered lines", "args": (lines,)}))
+        finally:
+            self.buffer = []
+            self.release()
+
+
+class BoundedQueueHandler(QueueHandler):
+    """ Queue handler that only enqueues records,
+    leaving redaction and formatting to the listener thread
+    """
+
+    def __init__(self, log_queue: queue.Queue, overload: str = "block"):
+        """
+        initialize arguments, overload is either
+        'block' (wait for room) or 'drop' (discard the record)
+        """
+        if overload not in OVERLOAD_POLICIES:
+            raise ValueError("overload must be one of {}".format(
+                ", ".join(OVERLOAD_POLICIES)))
+        super(BoundedQueueHandler, self).__init__(log_queue)
+        self.overload = overload
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        merge the message arguments without formatting so
+        the request thread never pays for redaction
+        """
+        record = copy.copy(record)
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        """
+        put the record on the queue according to the overload policy
+        """
+        if self.overload == "block":
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class BatchQueueListener(QueueListener):
+    """ Queue listener that drains records in batches
+    and flushes its handlers once per batch
+    """
+
+    def __init__(self, log_queue: queue.Queue, *handlers,
+                 batch_size: int = 512):
+        """
+        initialize arguments
+        """
+        super(BatchQueueListener, self).__init__(log_queue, *handlers)
+        self.batch_size = batch_size
+
+    def enqueue_sentinel(self) -> None:
+        """
+        wait until the stop sentinel fits in a bounded queue,
+        giving up once the listener thread is gone since
+        nothing would ever make room
+        """
+        while self._thread is not None and self._thread.is_alive():
+            try:
+                self.queue.put(self._sentinel, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _monitor(self) -> None:
+        """
+        handle records until the sentinel is dequeued; handler errors
+        go to handleError and never stop the thread, or callers
+        blocked on a full queue would wait forever
         """
-        record.msg = filter_datum(self.fields, self.REDACTION,
-                                  record.getMessage(), self.SEPARATOR)
-        return super(RedactingFormatter, self).format(record)
+        has_task_done = hasattr(self.queue, 'task_done')
+        stop = False
+        while not stop:
+            batch = [self.dequeue(True)]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.dequeue(False))
+                except queue.Empty:
+                    break
+            for record in batch:
+                if record is self._sentinel:
+                    stop = True
+                else:
+                    try:
+                        self.handle(record)
+                    except Exception:
+                        self.handlers[0].handleError(record)
+                if has_task_done:
+                    self.queue.task_done()
+            for handler in self.handlers:
+                try:
+                    handler.flush()
+                except Exception:
+                    handler.handleError(logging.makeLogRecord({
+                        "msg": "flush failed"}))
+
+
+_listener = None
+
+
+def stop_logger() -> None:
+    """
+    stop the background listener, flushing every queued record
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
 
 
-def get_logger() -> logging.Logger:
+def get_logger(asynchronous: bool = False, queue_size: int = 10000,
+               overload: str = "block") -> logging.Logger:
     """
     returns a logging.Logger object.
+
+    with asynchronous set, the logger only enqueues records on a
+    queue bounded by queue_size and a background thread redacts,
+    formats and writes them in batches; overload picks what happens
+    when the queue is full ('block' or 'drop')
     """
     user_data = logging.getLogger('user_data')
     user_data.setLevel(logging.INFO)
-    stream_handler = logging.StreamHandler()
-    formatter = RedactingFormatter.format()
+    user_data.propagate = False
+    stop_logger()
+    for handler in list(user_data.handlers):
+        user_data.removeHandler(handler)
+
+    formatter = RedactingFormatter(list(PII_FIELDS))
+    if not asynchronous:
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(formatter)
+        user_data.addHandler(stream_handler)
+        return user_data
+
+    global _listener
+    log_queue = queue.Queue(queue_size)
+    stream_handler = BatchStreamHandler()
+    stream_handler.setFormatter(formatter)
+    _listener = BatchQueueListener(log_queue, stream_handler)
+    _listener.start()
+    user_data.addHandler(BoundedQueueHandler(log_queue, overload))
     return user_data
 
 
-def get_db():
+atexit.register(stop_logger)
+
+
+def connect_db():
     """
-    setting up db connection
+    opens a new connection configured from the
+    PERSONAL_DATA_DB_* environment variables
+
+    PERSONAL_DATA_DB_SQLITE points at a local SQLite file
+    holding a users table, used as a stand-in for MySQL
     """
+    sqlite_path = environ.get("PERSONAL_DATA_DB_SQLITE")
+    if sqlite_path:
+        return sqlite3.connect(sqlite_path, check_same_thread=False)
+
     db_config = {
         "host": environ.get("PERSONAL_DATA_DB_HOST", "localhost"),
         "user": environ.get("PERSONAL_DATA_DB_USERNAME", "root"),
@@ -76,11 +375,179 @@ def get_db():
     return connection
 
 
-def main():
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """
+    returns the shared connection pool, sized by
+    PERSONAL_DATA_DB_POOL_SIZE and expiring idle connections
+    after PERSONAL_DATA_DB_POOL_IDLE_TIMEOUT seconds
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(
+                connect_db,
+                size=int(environ.get("PERSONAL_DATA_DB_POOL_SIZE", 5)),
+                idle_timeout=float(environ.get(
+                    "PERSONAL_DATA_DB_POOL_IDLE_TIMEOUT", 300)))
+        return _pool
+
+
+def get_db():
+    """
+    setting up db connection
+
+    when PERSONAL_DATA_DB_POOL_SIZE is set the connection is
+    checked out of the shared pool and close() returns it
+    """
+    if int(environ.get("PERSONAL_DATA_DB_POOL_SIZE", 0)) > 0:
+        return get_pool().connect()
+    return connect_db()
+
+
+def unbuffered_cursor(db):
+    """
+    returns a cursor that streams rows from the server
+    instead of buffering the whole result set, falling
+    back to the default cursor for drivers like sqlite3
+    """
+    try:
+        return db.cursor(buffered=False)
+    except TypeError:
+        return db.cursor()
+
+
+def placeholder(db) -> str:
+    """
+    returns the query parameter marker of the driver behind db
+    """
+    if isinstance(db, PooledConnection):
+        db = db._connection
+    return "?" if isinstance(db, sqlite3.Connection) else "%s"
+
+
+def load_checkpoint(path: str, column: str) -> Any:
+    """
+    returns the watermark saved in the checkpoint file
+    at path, or None when no export has run yet
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("column") != column:
+        raise ValueError("checkpoint {} tracks {}, not {}".format(
+            path, checkpoint.get("column"), column))
+    return checkpoint.get("value")
+
+
+def save_checkpoint(path: str, column: str, value: Any) -> None:
+    """
+    atomically replaces the checkpoint file with a new watermark
+    """
+    if not isinstance(value, (int, float)):
+        value = str(value)
+    tmp_path = "{}.tmp".format(path)
+    with open(tmp_path, 'w') as f:
+        json.dump({"column": column, "value": value}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def export_users(db, stream: TextIO = None, batch_size: int = 1000,
+                 fields: Tuple[str, ...] = PII_FIELDS, watermark: str = None,
+                 checkpoint: str = CHECKPOINT_FILE) -> int:
+    """
+    streams the users table to stream in fetchmany batches,
+    redacting the columns named in fields by index and
+    writing each batch of log lines in a single call;
+    returns the number of rows exported
+
+    with a watermark column, only rows from the value saved in the
+    checkpoint file on are exported, and the checkpoint advances
+    after every batch so an interrupted run resumes where it
+    stopped. The column need not be unique, and rows committed later
+    with the checkpointed value (a last_login in the same second)
+    must not be missed, so a run starts again at that value itself:
+    the rows holding it are exported again, duplicates downstream
+    consumers have to tolerate
+    """
+    if stream is None:
+        stream = sys.stderr
+    formatter = RedactingFormatter(list(fields))
+    redaction = formatter.REDACTION
+    cursor = unbuffered_cursor(db)
+    if watermark is None:
+        cursor.execute("SELECT * FROM users;")
+    else:
+        if not watermark.isidentifier():
+            raise ValueError("invalid watermark column {}".format(watermark))
+        since = load_checkpoint(checkpoint, watermark)
+        if since is None:
+            cursor.execute(
+                "SELECT * FROM users ORDER BY {};".format(watermark))
+        else:
+            cursor.execute("SELECT * FROM users WHERE {0} >= {1} "
+                           "ORDER BY {0};".format(watermark, placeholder(db)),
+                           (since,))
+    field_names = [i[0] for i in cursor.description]
+    columns = [(f"{name}=", name in fields) for name in field_names]
+    if watermark is not None:
+        mark = field_names.index(watermark)
+
+    count = 0
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        head = formatter.FORMAT % {
+            "name": "user_data",
+            "levelname": logging.getLevelName(logging.INFO),
+            "asctime": formatter.formatTime(logging.makeLogRecord({})),
+            "message": ""
+        }
+        stream.write(''.join([
+            head + '; '.join([
+                key + redaction if redacted else key + str(value)
+                for (key, redacted), value in zip(columns, row)
+            ]) + ';\n'
+            for row in rows
+        ]))
+        count += len(rows)
+        if watermark is not None:
+            stream.flush()
+            save_checkpoint(checkpoint, watermark, rows[-1][mark])
+    stream.flush()
+
+    cursor.close()
+    return count
+
+
+def main(batch_size: int = None, watermark: str = None):
     """
     retrieve and fromat data in db
+
+    with a batch_size (or PERSONAL_DATA_EXPORT_BATCH_SIZE set),
+    rows are streamed through export_users instead; a watermark
+    column (or PERSONAL_DATA_EXPORT_WATERMARK) makes the export
+    incremental, checkpointed in PERSONAL_DATA_EXPORT_CHECKPOINT
     """
+    if batch_size is None:
+        batch_size = int(environ.get("PERSONAL_DATA_EXPORT_BATCH_SIZE", 0))
+    if watermark is None:
+        watermark = environ.get("PERSONAL_DATA_EXPORT_WATERMARK")
     db = get_db()
+    if batch_size > 0 or watermark:
+        export_users(db, batch_size=batch_size or 1000, watermark=watermark,
+                     checkpoint=environ.get("PERSONAL_DATA_EXPORT_CHECKPOINT",
+                                            CHECKPOINT_FILE))
+        db.close()
+        return
+
     cursor = db.cursor()
     cursor.execute("SELECT * FROM users;")
     field_names = [i[0] for i in cursor.description]
@@ -93,3 +560,7 @@ def main():
 
     cursor.close()
     db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+module that runs password hashing and verification
+in a pool of processes behind a bounded queue
+"""
+
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Callable, Dict
+import os
+import threading
+import time
+
+
+def _timed(fn: Callable, *args: Any) -> tuple:
+    """
+    runs fn in a worker process and returns its
+    result with the seconds it took
+    """
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+class HashService():
+    """ Process pool that hashes and checks passwords
+    off the calling thread, with a bounded queue and metrics
+    """
+
+    def __init__(self, hash_fn: Callable, check_fn: Callable,
+                 workers: int = None, max_pending: int = None,
+                 timeout: float = None):
+        """
+        initialize arguments; hash_fn and check_fn must be module
+        level functions so they can be sent to the workers. At most
+        max_pending calls are queued or running at once and callers
+        wait up to timeout seconds (forever when None) for room
+        """
+        self.hash_fn = hash_fn
+        self.check_fn = check_fn
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * 4
+        self.timeout = timeout
+        self._pool = ProcessPoolExecutor(self.workers)
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._completed = 0
+        self._failed = 0
+        self._service_time = 0.0
+        self._wait_time = 0.0
+
+    def submit(self, fn: Callable, *args: Any) -> Future:
+        """
+        queue fn(*args) on the pool and return a future of its result,
+        blocking while max_pending calls are already outstanding
+        """
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError("hash service queue is full")
+        queued = time.perf_counter()
+        with self._lock:
+            self._pending += 1
+        result = Future()
+
+        def done(inner: Future) -> None:
+            """
+            record metrics and hand the result to the caller
+            """
+            total = time.perf_counter() - queued
+            with self._lock:
+                self._pending -= 1
+                try:
+                    value, elapsed = inner.result()
+                except BaseException as e:
+                    self._failed += 1
+                    value, error = None, e
+                else:
+                    self._completed += 1
+                    self._service_time += elapsed
+                    self._wait_time += max(0.0, total - elapsed)
+                    error = None
+            self._slots.release()
+            if error is None:
+                result.set_result(value)
+            else:
+                result.set_exception(error)
+
+        try:
+            self._pool.submit(_timed, fn, *args).add_done_callback(done)
+        except BaseException:
+            with self._lock:
+                self._pending -= 1
+            self._slots.release()
+            raise
+        return result
+
+    def hash_async(self, *args: Any) -> Future:
+        """
+        returns a future of hash_fn(*args)
+        """
+        return self.submit(self.hash_fn, *args)
+
+    def check_async(self, *args: Any) -> Future:
+        """
+        returns a future of check_fn(*args)
+        """
+        return self.submit(self.check_fn, *args)
+
+    def hash(self, *args: Any) -> Any:
+        """
+        hashes in the pool and waits for the result
+        """
+        return self.hash_async(*args).result()
+
+    def check(self, *args: Any) -> Any:
+        """
+        verifies in the pool and waits for the result
+        """
+        return self.check_async(*args).result()
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        returns the queue depth and average queue wait
+        and service times in milliseconds
+        """
+        with self._lock:
+            done = self._completed or 1
+            return {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "queue_depth": self._pending,
+                "completed": self._completed,
+                "failed": self._failed,
+                "avg_service_ms": self._service_time / done * 1000,
+                "avg_wait_ms": self._wait_time / done * 1000,
+            }
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        stop the worker processes
+        """
+        self._pool.shutdown(wait=wait)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+command line tool that redacts PII fields from
+existing log files using a pool of processes
+"""
+
+from argparse import ArgumentParser
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Tuple
+import mmap
+import os
+import sys
+import time
+
+from filtered_logger import (PII_FIELDS, RedactingFormatter,
+                             redact, redaction_pattern, redaction_template)
+
+CHUNK_SIZE = 16 * 1024 * 1024
+
+
+def line_chunks(data: mmap.mmap,
+                chunk_size: int) -> Iterator[Tuple[int, int]]:
+    """
+    yields (start, end) offsets of chunks of roughly
+    chunk_size bytes, each ending on a line boundary
+    """
+    size = len(data)
+    start = 0
+    while start < size:
+        end = data.find(b'\n', min(start + chunk_size, size) - 1)
+        end = size if end == -1 else end + 1
+        yield start, end
+        start = end
+
+
+def redact_chunk(path: str, start: int, end: int, fields: Tuple[str, ...],
+                 redaction: str, separator: str) -> bytes:
+    """
+    maps the [start, end) slice of path and returns it redacted;
+    runs inside a worker process so only offsets cross the pool
+    """
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            text = data[start:end].decode('utf-8', 'surrogateescape')
+    if not fields:
+        return text.encode('utf-8', 'surrogateescape')
+    text = redact(redaction_pattern(fields, separator),
+                  redaction_template(redaction, separator), text)
+    return text.encode('utf-8', 'surrogateescape')
+
+
+def redact_file(src: str, dst: str, fields: Tuple[str, ...] = PII_FIELDS,
+                redaction: str = RedactingFormatter.REDACTION,
+                separator: str = RedactingFormatter.SEPARATOR,
+                chunk_size: int = CHUNK_SIZE, workers: int = None,
+                progress: bool = True) -> Tuple[int, float]:
+    """
+    redacts src into dst chunk by chunk across a process pool,
+    writing chunks in input order; returns the number of bytes
+    read and the elapsed seconds
+    """
+    started = time.perf_counter()
+    total = os.path.getsize(src)
+    if total == 0:
+        open(dst, 'wb').close()
+        return 0, time.perf_counter() - started
+
+    workers = workers or os.cpu_count() or 1
+    done = 0
+    with open(src, 'rb') as f, open(dst, 'wb') as out, \
+            ProcessPoolExecutor(workers) as pool:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            pending = deque()
+            for start, end in line_chunks(data, chunk_size):
+                pending.append((end - start, pool.submit(
+                    redact_chunk, src, start, end, fields,
+                    redaction, separator)))
+                if len(pending) < workers * 2:
+                    continue
+                done += _write_next(pending, out)
+                if progress:
+                    _report(done, total, started)
+            while pending:
+                done += _write_next(pending, out)
+                if progress:
+                    _report(done, total, started)
+    return total, time.perf_counter() - started
+
+
+def _write_next(pending: deque, out) -> int:
+    """
+    waits for the oldest chunk, writes it and returns its input size
+    """
+    size, future = pending.popleft()
+    out.write(future.result())
+    return size
+
+
+def _report(done: int, total: int, started: float) -> None:
+    """
+    prints a one line progress update to stderr
+    """
+    elapsed = time.perf_counter() - started
+    sys.stderr.write("\r{:6.2f}% {:10.1f} MB {:8.1f} MB/s".format(
+        100.0 * done / total, done / 1e6, done / 1e6 / max(elapsed, 1e-9)))
+    sys.stderr.flush()
+
+
+def main(argv: List[str] = None) -> None:
+    """
+    parse the command line and redact the given log file
+    """
+    parser = ArgumentParser(description="Redact PII fields from log files")
+    parser.add_argument("src", help="log file to redact")
+    parser.add_argument("dst", help="where to write the redacted log")
+    parser.add_argument("-f", "--fields", default=",".join(PII_FIELDS),
+                        help="comma separated fields to redact")
+    parser.add_argument("-r", "--redaction",
+                        default=RedactingFormatter.REDACTION)
+    parser.add_argument("-s", "--separator",
+                        default=RedactingFormatter.SEPARATOR)
+    parser.add_argument("-c", "--chunk-size", type=int,
+                        default=CHUNK_SIZE // (1024 * 1024),
+                        help="chunk size in MiB")
+    parser.add_argument("-w", "--workers", type=int, default=None)
+    parser.add_argument("-q", "--quiet", action="store_true",
+                        help="no progress reporting")
+    args = parser.parse_args(argv)
+
+    fields = tuple(f for f in args.fields.split(",") if f)
+    total, elapsed = redact_file(args.src, args.dst, fields, args.redaction,
+                                 args.separator,
+                                 args.chunk_size * 1024 * 1024,
+                                 args.workers, not args.quiet)
+    if not args.quiet:
+        sys.stderr.write("\n")
+    print("redacted {:.1f} MB in {:.2f}s ({:.1f} MB/s)".format(
+        total / 1e6, elapsed, total / 1e6 / max(elapsed, 1e-9)))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,14 +6,39 @@ from flask import abort, jsonify, request
 from models.user import User
 
 
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
 @app_views.route('/users', methods=['GET'], strict_slashes=False)
 def view_all_users() -> str:
     """ GET /api/v1/users
+    Query parameters (optional):
+      - limit: users per page, 100 by default, at most 1000
+      - cursor: next_cursor of the previous page
     Return:
       - list of all User objects JSON represented
+      - with limit or cursor, one page of Users ordered by ID:
+        {"users": [...], "next_cursor": ID or null on the last page}
+      - 400 if limit isn't a number between 1 and 1000
     """
-    all_users = [user.to_json() for user in User.all()]
-    return jsonify(all_users)
+    if 'limit' not in request.args and 'cursor' not in request.args:
+        all_users = [user.to_json() for user in User.all()]
+        return jsonify(all_users)
+    try:
+        limit = int(request.args.get('limit', PAGE_SIZE))
+    except ValueError:
+        limit = 0
+    if not 0 < limit <= MAX_PAGE_SIZE:
+        return jsonify({'error': "Wrong limit"}), 400
+    page = [user.to_json() for user in
+            User.iter(after_id=request.args.get('cursor') or None,
+                      limit=limit + 1)]
+    next_cursor = None
+    if len(page) > limit:
+        page.pop()
+        next_cursor = page[-1]['id']
+    return jsonify({'users': page, 'next_cursor': next_cursor})
 
 
 @app_views.route('/users/<user_id>', methods=['GET'], strict_slashes=False)
@@ -95,6 +120,71 @@ def create_user() -> str:
     return jsonify({'error': error_msg}), 400
 
 
+@app_views.route('/users/batch', methods=['POST'], strict_slashes=False)
+def create_users() -> str:
+    """ POST /api/v1/users/batch
+    JSON body:
+      - list of objects with the create_user parameters
+    Return:
+      - list of User objects JSON represented
+      - 400 if one of them can't be created, none is created then
+    """
+    rj = None
+    error_msg = None
+    try:
+        rj = request.get_json()
+    except Exception as e:
+        rj = None
+    if type(rj) is not list or \
+            any(type(item) is not dict for item in rj):
+        error_msg = "Wrong format"
+    for i, item in enumerate(rj if error_msg is None else []):
+        if item.get("email", "") == "":
+            error_msg = "email missing at {}".format(i)
+        elif item.get("password", "") == "":
+            error_msg = "password missing at {}".format(i)
+        if error_msg is not None:
+            break
+    if error_msg is None:
+        try:
+            users = []
+            for item in rj:
+                user = User()
+                user.email = item.get("email")
+                user.password = item.get("password")
+                user.first_name = item.get("first_name")
+                user.last_name = item.get("last_name")
+                users.append(user)
+            User.save_many(users)
+            return jsonify([user.to_json() for user in users]), 201
+        except Exception as e:
+            error_msg = "Can't create Users: {}".format(e)
+    return jsonify({'error': error_msg}), 400
+
+
+@app_views.route('/users/batch', methods=['DELETE'], strict_slashes=False)
+def delete_users() -> str:
+    """ DELETE /api/v1/users/batch
+    JSON body:
+      - list of User IDs
+    Return:
+      - the IDs deleted and the IDs that don't exist
+      - 400 if the body isn't a list of IDs
+    """
+    rj = None
+    try:
+        rj = request.get_json()
+    except Exception as e:
+        rj = None
+    if type(rj) is not list or any(type(i) is not str for i in rj):
+        return jsonify({'error': "Wrong format"}), 400
+    deleted = User.remove_many(rj)
+    found = set(deleted)
+    not_found = [user_id for user_id in dict.fromkeys(rj)
+                 if user_id not in found]
+    return jsonify({'deleted': deleted, 'not_found': not_found}), 200
+
+
 @app_views.route('/users/<user_id>', methods=['PUT'], strict_slashes=False)
 def update_user(user_id: str = None) -> str:
     """ PUT /api/v1/users/:id
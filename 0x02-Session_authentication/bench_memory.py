@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+""" Memory benchmark: memory held by the User store once N users are
+loaded from file with User.load_from_file, objects, indexes and
+ID order included, regular records against compact (packed
+__slots__) records; measured with tracemalloc in a fresh process
+
+Usage: ./bench_memory.py [N]
+"""
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+import uuid
+
+
+def write_store(count: int):
+    """ Write a .db_User.json snapshot of count users
+    """
+    with open(".db_User.json", "w") as f:
+        f.write("{")
+        for i in range(count):
+            obj_id = str(uuid.uuid4())
+            record = {
+                "id": obj_id,
+                "created_at": "2023-09-07T22:25:52",
+                "updated_at": "2023-09-07T22:25:52",
+                "email": "user{}@example.com".format(i),
+                "_password": hashlib.sha256(str(i).encode()).hexdigest(),
+                "first_name": "First{}".format(i),
+                "last_name": "Last{}".format(i)}
+            f.write("{}{}: {}".format("" if i == 0 else ", ",
+                                      json.dumps(obj_id),
+                                      json.dumps(record)))
+        f.write("}")
+
+
+def measure() -> int:
+    """ Load the snapshot and return the bytes still allocated
+    """
+    from models.user import User
+
+    tracemalloc.start()
+    User.load_from_file()
+    User.search({'email': "user0@example.com"})
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "measure":
+        print(measure())
+        sys.exit(0)
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    script = os.path.abspath(__file__)
+    here = os.path.dirname(script)
+    os.chdir(tempfile.mkdtemp())
+    write_store(count)
+    results = {}
+    for mode in ("0", "1"):
+        env = dict(os.environ, BASE_COMPACT_RECORDS=mode,
+                   PYTHONPATH=here)
+        out = subprocess.run([sys.executable, script, "measure"],
+                             env=env, check=True,
+                             capture_output=True, text=True).stdout
+        results[mode] = int(out)
+    for mode, label in (("0", "regular"), ("1", "compact")):
+        print("{:<8} {:>10.1f} MB  {:>6.0f} bytes/user".format(
+            label, results[mode] / 1024 / 1024, results[mode] / count))
+    print("ratio    {:>10.2f}x".format(results["0"] / results["1"]))
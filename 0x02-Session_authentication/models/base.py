@@ -1,37 +1,506 @@
 #!/usr/bin/env python3
 """ Base module
 """
+from contextlib import contextmanager
 from datetime import datetime
-from typing import TypeVar, List, Iterable
-from os import path
+from itertools import chain
+from typing import TypeVar, List, Iterable, Iterator, Tuple
+from os import getenv, path
+import atexit
+import bisect
+import io
 import json
+import os
+import signal
+import threading
+import time
 import uuid
 
+from models import binary_store
+# conditions stay importable from models.base
+from models.query import (Condition, HashIndex, In, Prefix, Range,
+                          SortedIndex, matches)
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+STORE_FORMATS = ("json", "ndjson", "bin")
 DATA = {}
+RAW = {}
+INDEXES = {}
+JOURNALS = {}
+JOURNAL_LOCK = threading.Lock()
+COMPACT_LOCK = threading.Lock()
+DIRTY = {}
+DIRTY_CLASSES = {}
+FLUSH_CONDITION = threading.Condition()
+FLUSHER = []
+PREVIOUS_HANDLERS = {}
+LOCKS = {}
+LOCKS_LOCK = threading.Lock()
+FSYNC_POLICIES = ("always", "batched", "never")
+LAST_FSYNC = {}
+FSYNC_TIMERS = {}
+FSYNC_LOCK = threading.Lock()
+SNAPSHOT_BUFFER_SIZE = 1 << 20
+BUFFERS = threading.local()
+JSON_CACHE = "__json_cache__"
+ORDERS = {}
+ORDER_CHUNK = 256
+
+
+def _flush_loop():
+    """ Flush dirty classes every write_behind_interval seconds,
+    or sooner when woken up by mark_dirty
+    """
+    while True:
+        with FLUSH_CONDITION:
+            FLUSH_CONDITION.wait(Base.write_behind_interval or None)
+        Base.flush()
+
+
+def _flush_on_signal(signum, frame):
+    """ Hand the signal on to the previous handler, or exit through
+    SystemExit so the atexit flush runs. Flushing here could deadlock:
+    the main thread may be holding a store or journal lock when the
+    signal interrupts it, so the flush waits until it has unwound
+    """
+    previous = PREVIOUS_HANDLERS.get(signum)
+    if callable(previous):
+        previous(signum, frame)
+    elif previous != signal.SIG_IGN:
+        raise SystemExit(128 + signum)
+
+
+def start_flusher():
+    """ Start the write-behind flusher thread once, flushing on
+    exit through atexit and on SIGTERM when called from the main
+    thread, unless SIGTERM is ignored
+    """
+    if FLUSHER:
+        return
+    FLUSHER.append(threading.Thread(target=_flush_loop, daemon=True))
+    FLUSHER[0].start()
+    atexit.register(Base.flush)
+    try:
+        if signal.getsignal(signal.SIGTERM) != signal.SIG_IGN:
+            PREVIOUS_HANDLERS[signal.SIGTERM] = signal.signal(
+                signal.SIGTERM, _flush_on_signal)
+    except ValueError:
+        # signal handlers can only be set from the main thread
+        pass
+
+
+def snapshot_buffer() -> io.StringIO:
+    """ Return the serialization buffer of the calling thread,
+    kept across snapshot writes
+    """
+    buffer = getattr(BUFFERS, 'buffer', None)
+    if buffer is None:
+        buffer = BUFFERS.buffer = io.StringIO()
+    return buffer
+
+
+def drain(buffer: io.StringIO, f, threshold: int = 0):
+    """ Move the buffer content to f once it holds threshold
+    characters, leaving the buffer empty for reuse
+    """
+    if buffer.tell() < threshold or not buffer.tell():
+        return
+    f.write(buffer.getvalue())
+    buffer.seek(0)
+    buffer.truncate()
+
+
+def fsync_directory(file_path: str):
+    """ Sync the directory of file_path so a rename into it is durable
+    """
+    try:
+        fd = os.open(path.dirname(file_path) or ".", os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        # some platforms and file systems cannot sync directories
+        pass
+    finally:
+        os.close(fd)
+
+
+def deferred_fsync(file_path: str):
+    """ Sync file_path and its directory for the writes the batched
+    fsync policy left unsynced
+    """
+    with FSYNC_LOCK:
+        FSYNC_TIMERS.pop(file_path, None)
+        LAST_FSYNC[file_path] = time.monotonic()
+    try:
+        fd = os.open(file_path, os.O_RDONLY)
+    except OSError:
+        # replaced or compacted away since; its successor is
+        # synced on its own
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    fsync_directory(file_path)
+
+
+def journal_entries(line: bytes) -> List[dict]:
+    """ Decode the entries of one journal line. There can be several:
+    before torn lines were detected by their missing newline, an
+    append could be glued onto an interrupted one
+    """
+    decoder = json.JSONDecoder()
+    text = line.decode().strip()
+    entries = []
+    position = 0
+    while position < len(text):
+        entry, position = decoder.raw_decode(text, position)
+        entries.append(entry)
+    return entries
+
+
+class StoreLock():
+    """ Reader/writer lock of one class store. Any number of
+    readers or one writer at a time; waiting writers keep new
+    readers out, and the writer may re-enter either side.
+    files serializes the writes of the class files so they
+    happen in the same order as the changes they record
+    """
+
+    def __init__(self):
+        """ Initialize an unlocked store lock
+        """
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writers_waiting = 0
+        self._writer = None
+        self._depth = 0
+        self.files = threading.RLock()
+
+    @contextmanager
+    def read(self):
+        """ Hold the lock shared
+        """
+        me = threading.get_ident()
+        if self._writer == me:
+            yield
+            return
+        with self._condition:
+            while self._writer is not None or self._writers_waiting:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        """ Hold the lock exclusively
+        """
+        me = threading.get_ident()
+        with self._condition:
+            if self._writer != me:
+                self._writers_waiting += 1
+                while self._writer is not None or self._readers:
+                    self._condition.wait()
+                self._writers_waiting -= 1
+                self._writer = me
+            self._depth += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._depth -= 1
+                if not self._depth:
+                    self._writer = None
+                    self._condition.notify_all()
+
+
+class Storage():
+    """ Interface of the storage backends behind Base
+    """
+
+    def load(self, cls: type):
+        """ Prepare the store of cls
+        """
+        raise NotImplementedError()
+
+    def save(self, obj: TypeVar('Base')):
+        """ Create or update obj
+        """
+        raise NotImplementedError()
+
+    def save_all(self, cls: type, objs: List[TypeVar('Base')]):
+        """ Create or update many objects of cls
+        """
+        for obj in objs:
+            self.save(obj)
+
+    def remove(self, obj: TypeVar('Base')):
+        """ Delete obj
+        """
+        raise NotImplementedError()
+
+    def remove_all(self, cls: type, obj_ids: List[str]) -> List[str]:
+        """ Delete the objects of cls with obj_ids and
+        return the IDs that were found
+        """
+        removed = []
+        for obj_id in obj_ids:
+            obj = self.get(cls, obj_id)
+            if obj is not None:
+                self.remove(obj)
+                removed.append(obj_id)
+        return removed
+
+    def get(self, cls: type, obj_id: str) -> TypeVar('Base'):
+        """ Return the object of cls with obj_id, or None
+        """
+        raise NotImplementedError()
+
+    def candidates(self, cls: type,
+                   attributes: dict) -> Iterable[TypeVar('Base')]:
+        """ Return the objects of cls that may match attributes,
+        all of them when no index narrows the search
+        """
+        raise NotImplementedError()
+
+    def ordered(self, cls: type, attributes: dict,
+                after_id: str = None) -> Iterator[TypeVar('Base')]:
+        """ Yield the objects of cls that may match attributes,
+        in ID order, starting after after_id
+        """
+        raise NotImplementedError()
+
+    def count(self, cls: type) -> int:
+        """ Count the objects of cls
+        """
+        raise NotImplementedError()
+
+
+class FileStorage(Storage):
+    """ Objects kept in DATA and persisted to JSON
+    or newline-delimited files, see Base.persist
+    """
+
+    def load(self, cls: type):
+        """ Load all objects from file, replaying the
+        journal on top of the snapshot
+        """
+        s_class = cls.__name__
+        file_path = cls.snapshot_path()
+        # a compaction finishing halfway through would remove the
+        # old journal after the previous snapshot was read
+        with COMPACT_LOCK, cls.store_lock().write():
+            DATA[s_class] = {}
+            RAW[s_class] = {}
+            cls.rebuild_indexes()
+
+            if path.exists(file_path):
+                if cls.store_format == "ndjson":
+                    records = cls.read_ndjson(file_path)
+                elif cls.store_format == "bin":
+                    with open(file_path, 'rb') as f:
+                        records = binary_store.load(f)
+                else:
+                    with open(file_path, 'r') as f:
+                        records = json.load(f).items()
+                target = RAW[s_class] if cls.lazy_load else DATA[s_class]
+                build = (lambda record: record) if cls.lazy_load \
+                    else cls.from_record
+                for obj_id, record in records:
+                    target[obj_id] = build(record)
+            for journal_path in cls.journal_paths()[::-1]:
+                cls.replay_journal(journal_path)
+            cls.rebuild_indexes()
+
+    def save(self, obj: TypeVar('Base')):
+        """ Store obj and persist the change
+        """
+        cls = obj.__class__
+        s_class = cls.__name__
+        lock = cls.store_lock()
+        with lock.files:
+            with lock.write():
+                RAW.get(s_class, {}).pop(obj.id, None)
+                DATA[s_class][obj.id] = obj
+                cls.index(obj)
+                entry = {"op": "save", "id": obj.id,
+                         "obj": obj.to_json(True)}
+            cls.persist([entry])
+
+    def save_all(self, cls: type, objs: List[TypeVar('Base')]):
+        """ Store objs and persist them at once
+        """
+        s_class = cls.__name__
+        lock = cls.store_lock()
+        with lock.files:
+            with lock.write():
+                entries = []
+                for obj in objs:
+                    RAW.get(s_class, {}).pop(obj.id, None)
+                    DATA[s_class][obj.id] = obj
+                    cls.index(obj)
+                    entries.append({"op": "save", "id": obj.id,
+                                    "obj": obj.to_json(True)})
+            cls.persist(entries)
+
+    def remove(self, obj: TypeVar('Base')):
+        """ Drop obj and persist the change
+        """
+        cls = obj.__class__
+        s_class = cls.__name__
+        lock = cls.store_lock()
+        cls.materialize(obj.id)
+        with lock.files:
+            with lock.write():
+                if DATA[s_class].pop(obj.id, None) is None:
+                    return
+                cls.unindex(obj.id)
+            cls.persist([{"op": "remove", "id": obj.id}])
+
+    def remove_all(self, cls: type, obj_ids: List[str]) -> List[str]:
+        """ Drop the objects with obj_ids, built or not, and persist
+        the changes at once; returns the IDs that were found
+        """
+        s_class = cls.__name__
+        lock = cls.store_lock()
+        with lock.files:
+            with lock.write():
+                removed = []
+                for obj_id in obj_ids:
+                    if DATA[s_class].pop(obj_id, None) is None \
+                            and RAW.get(s_class, {}).pop(obj_id,
+                                                         None) is None:
+                        continue
+                    cls.unindex(obj_id)
+                    removed.append(obj_id)
+            cls.persist([{"op": "remove", "id": obj_id}
+                         for obj_id in removed])
+        return removed
+
+    def get(self, cls: type, obj_id: str) -> TypeVar('Base'):
+        """ Return one object by ID, building it if lazily loaded
+        """
+        s_class = cls.__name__
+        if obj_id in RAW.get(s_class, {}):
+            cls.materialize(obj_id)
+        with cls.store_lock().read():
+            return DATA[s_class].get(obj_id)
+
+    def candidates(self, cls: type,
+                   attributes: dict) -> Iterable[TypeVar('Base')]:
+        """ Return the objects indexed under one of attributes, all
+        objects otherwise; copied under the read lock so the caller
+        can filter them outside of it
+        """
+        s_class = cls.__name__
+        cls.materialize()
+        if s_class not in INDEXES:
+            cls.rebuild_indexes()
+        with cls.store_lock().read():
+            objs = self.plan(cls, attributes)
+            if objs is None:
+                objs = list(DATA[s_class].values())
+            return objs
+
+    @staticmethod
+    def plan(cls: type, attributes: dict) -> List[TypeVar('Base')]:
+        """ Return the objects selected by the index expected to
+        return the fewest of them for one of attributes, None when
+        no index can serve any; called under the read lock, the
+        caller filters on the remaining attributes
+        """
+        best = None
+        for index in INDEXES[cls.__name__]:
+            if index.attribute not in attributes:
+                continue
+            condition = attributes[index.attribute]
+            estimate = index.estimate(condition)
+            if estimate is not None and (best is None or estimate < best[0]):
+                best = (estimate, index, condition)
+        if best is None:
+            return None
+        return best[1].select(best[2])
+
+    def ordered(self, cls: type, attributes: dict,
+                after_id: str = None) -> Iterator[TypeVar('Base')]:
+        """ Yield the objects of cls that may match attributes in ID
+        order, starting after after_id. The read lock is only held
+        to copy one chunk of IDs at a time, never across a yield
+        """
+        s_class = cls.__name__
+        if s_class not in INDEXES:
+            cls.rebuild_indexes()
+        lock = cls.store_lock()
+        if attributes:
+            cls.materialize()
+        with lock.read():
+            objs = self.plan(cls, attributes)
+        if objs is not None:
+            yield from sorted((obj for obj in objs
+                               if after_id is None or obj.id > after_id),
+                              key=lambda obj: obj.id)
+            return
+        while True:
+            with lock.read():
+                order = ORDERS[s_class]
+                start = 0 if after_id is None \
+                    else bisect.bisect_right(order, after_id)
+                ids = order[start:start + ORDER_CHUNK]
+            if not ids:
+                return
+            for obj_id in ids:
+                obj = self.get(cls, obj_id)
+                if obj is not None:
+                    yield obj
+            after_id = ids[-1]
+
+    def count(self, cls: type) -> int:
+        """ Count stored and not yet built objects
+        """
+        s_class = cls.__name__
+        with cls.store_lock().read():
+            return len(DATA[s_class].keys()) + len(RAW.get(s_class, {}))
 
 
 class Base():
     """ Base class
     """
 
+    __slots__ = ()
+    indexed_attributes = ()
+    sorted_attributes = ()
+    record_fields = ()
+    storage_mode = getenv("BASE_STORAGE_MODE", "snapshot")
+    journal_compact_threshold = int(getenv("BASE_JOURNAL_COMPACT", 10000))
+    write_behind_interval = float(getenv("BASE_WRITE_BEHIND_INTERVAL", 0))
+    write_behind_max_dirty = int(getenv("BASE_WRITE_BEHIND_MAX_DIRTY", 1000))
+    store_format = getenv("BASE_STORE_FORMAT", "json")
+    lazy_load = getenv("BASE_LAZY_LOAD", "") == "1"
+    storage_backend = getenv("BASE_STORAGE_BACKEND", "json")
+    fsync_policy = getenv("BASE_FSYNC", "always")
+    fsync_interval = float(getenv("BASE_FSYNC_INTERVAL", 1))
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a Base instance
         """
         s_class = str(self.__class__.__name__)
-        if DATA.get(s_class) is None:
-            DATA[s_class] = {}
+        DATA.setdefault(s_class, {})
 
-        self.id = kwargs.get('id', str(uuid.uuid4()))
+        self.id = kwargs['id'] if 'id' in kwargs else str(uuid.uuid4())
         if kwargs.get('created_at') is not None:
-            self.created_at = datetime.strptime(kwargs.get('created_at'),
-                                                TIMESTAMP_FORMAT)
+            self.created_at = to_datetime(kwargs.get('created_at'))
         else:
             self.created_at = datetime.utcnow()
         if kwargs.get('updated_at') is not None:
-            self.updated_at = datetime.strptime(kwargs.get('updated_at'),
-                                                TIMESTAMP_FORMAT)
+            self.updated_at = to_datetime(kwargs.get('updated_at'))
         else:
             self.updated_at = datetime.utcnow()
 
@@ -44,69 +513,483 @@ class Base():
             return False
         return (self.id == other.id)
 
+    def __setattr__(self, name: str, value):
+        """ Set an attribute, dropping the cached serialized forms
+        """
+        super().__setattr__(name, value)
+        self.__dict__.pop(JSON_CACHE, None)
+
+    def json_cache(self) -> dict:
+        """ Return the cached serialized forms of the object, kept
+        until the next attribute assignment; changes made inside a
+        mutable attribute value are not seen, assign it again
+        """
+        cache = self.__dict__.get(JSON_CACHE)
+        if cache is None:
+            cache = self.__dict__[JSON_CACHE] = {}
+        return cache
+
     def to_json(self, for_serialization: bool = False) -> dict:
         """ Convert the object a JSON dictionary
         """
-        result = {}
-        for key, value in self.__dict__.items():
-            if not for_serialization and key[0] == '_':
-                continue
-            if type(value) is datetime:
-                result[key] = value.strftime(TIMESTAMP_FORMAT)
-            else:
-                result[key] = value
+        cache = self.json_cache()
+        result = cache.get(for_serialization)
+        if result is None:
+            result = {}
+            # iterate a copy: any assignment from another thread adds
+            # or drops the cache key, which would break the iteration
+            for key, value in list(self.__dict__.items()):
+                if key == JSON_CACHE:
+                    continue
+                if not for_serialization and key[0] == '_':
+                    continue
+                if type(value) is datetime:
+                    result[key] = value.strftime(TIMESTAMP_FORMAT)
+                else:
+                    result[key] = value
+            cache[for_serialization] = result
+        return dict(result)
+
+    def to_json_string(self, for_serialization: bool = False) -> str:
+        """ Return to_json encoded as a JSON string
+        """
+        cache = self.json_cache()
+        key = "string", for_serialization
+        result = cache.get(key)
+        if result is None:
+            result = cache[key] = json.dumps(self.to_json(for_serialization))
         return result
 
+    @classmethod
+    def store_lock(cls) -> StoreLock:
+        """ Return the lock guarding the objects of the class
+        """
+        s_class = cls.__name__
+        lock = LOCKS.get(s_class)
+        if lock is None:
+            with LOCKS_LOCK:
+                lock = LOCKS.setdefault(s_class, StoreLock())
+        return lock
+
+    @classmethod
+    def snapshot_path(cls, store_format: str = None) -> str:
+        """ Return the snapshot file of a store format
+        """
+        return ".db_{}.{}".format(cls.__name__,
+                                  store_format or cls.store_format)
+
+    @classmethod
+    def storage(cls) -> 'Storage':
+        """ Return the storage backend selected by storage_backend
+        """
+        storage = STORAGES.get(cls.storage_backend)
+        if storage is None:
+            with LOCKS_LOCK:
+                storage = STORAGES.get(cls.storage_backend)
+                if storage is None and cls.storage_backend == "sqlite":
+                    from models.sqlite_storage import SQLiteStorage
+                    storage = SQLiteStorage(getenv("BASE_SQLITE_PATH",
+                                                   ".db.sqlite3"))
+                    STORAGES["sqlite"] = storage
+        if storage is None:
+            raise ValueError("unknown storage backend {}".format(
+                cls.storage_backend))
+        return storage
+
     @classmethod
     def load_from_file(cls):
         """ Load all objects from file
         """
+        cls.storage().load(cls)
+
+    @staticmethod
+    def read_ndjson(file_path: str) -> Iterable[Tuple[str, str]]:
+        """ Yield (id, line) for each record of a newline-delimited
+        snapshot, one line at a time; the id is sliced out of the
+        line, which always starts with it, so it costs no parsing
+        """
+        prefix = '{"id": "'
+        with open(file_path, 'r') as f:
+            for line in f:
+                if line.startswith(prefix):
+                    end = line.find('"', len(prefix))
+                    obj_id = line[len(prefix):end]
+                    if end != -1 and '\\' not in obj_id:
+                        yield obj_id, line
+                        continue
+                if line.strip():
+                    yield json.loads(line)["id"], line
+
+    @classmethod
+    def from_record(cls, record) -> TypeVar('Base'):
+        """ Build an object from its serialized form,
+        a dictionary or a JSON line
+        """
+        if isinstance(record, str):
+            record = json.loads(record)
+        return cls(**record)
+
+    @classmethod
+    def materialize(cls, obj_id: str = None):
+        """ Build lazily loaded objects: the one with obj_id,
+        or all of them when no ID is given
+        """
         s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        DATA[s_class] = {}
-        if not path.exists(file_path):
+        raw = RAW.get(s_class)
+        if not raw:
             return
+        with cls.store_lock().write():
+            if obj_id is not None:
+                ids = [obj_id] if obj_id in raw else []
+            else:
+                ids = list(raw.keys())
+            built = []
+            for pending_id in ids:
+                record = raw.pop(pending_id, None)
+                if record is None:
+                    continue
+                obj = cls.from_record(record)
+                DATA[s_class][pending_id] = obj
+                built.append(obj)
+            if obj_id is not None:
+                for obj in built:
+                    cls.index(obj)
+            elif built:
+                # one sort per sorted index rather than one
+                # list insertion per object and index
+                cls.rebuild_indexes()
 
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[s_class][obj_id] = cls(**obj_json)
+    @classmethod
+    def convert_store(cls, src_format: str, dst_format: str):
+        """ Rewrite the snapshot of src_format (plus its journal) as
+        a snapshot of dst_format, passing records through as-is
+        """
+        for store_format in (src_format, dst_format):
+            if store_format not in STORE_FORMATS:
+                raise ValueError("unknown store format {}".format(
+                    store_format))
+        store_format, lazy_load = cls.store_format, cls.lazy_load
+        try:
+            cls.store_format, cls.lazy_load = src_format, True
+            STORAGES["json"].load(cls)
+            cls.store_format = dst_format
+            cls.write_snapshot(cls.snapshot_path(),
+                               DATA[cls.__name__].values(),
+                               RAW[cls.__name__])
+        finally:
+            cls.store_format, cls.lazy_load = store_format, lazy_load
 
     @classmethod
     def save_to_file(cls):
-        """ Save all objects to file
+        """ Save all objects to file, from a copy of the
+        store taken under the read lock
         """
+        if cls.storage_mode == "journal":
+            cls.compact()
+            return
         s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        objs_json = {}
-        for obj_id, obj in DATA[s_class].items():
-            objs_json[obj_id] = obj.to_json(True)
+        lock = cls.store_lock()
+        with lock.files:
+            with lock.read():
+                objs = list(DATA[s_class].values())
+                raw = dict(RAW.get(s_class, {}))
+            cls.write_snapshot(cls.snapshot_path(), objs, raw)
 
-        with open(file_path, 'w') as f:
-            json.dump(objs_json, f)
+    @classmethod
+    def write_snapshot(cls, file_path: str, objs: Iterable[TypeVar('Base')],
+                       raw: dict):
+        """ Write objects and not yet built records to a snapshot
+        file in the class store format. The file is replaced
+        atomically: records go through a reusable buffer into a
+        temporary file, synced as the fsync policy asks, which is
+        then renamed over file_path
+        """
+        buffer = snapshot_buffer()
+        tmp_path = "{}.{}-{}.tmp".format(file_path, os.getpid(),
+                                         threading.get_ident())
+        try:
+            with open(tmp_path, 'wb' if cls.store_format == "bin"
+                      else 'w') as f:
+                if cls.store_format == "bin":
+                    binary_store.dump(chain((obj.to_json(True)
+                                             for obj in objs),
+                                            raw.values()), f,
+                                      ("created_at", "updated_at"))
+                elif cls.store_format == "ndjson":
+                    for obj in objs:
+                        buffer.write(obj.to_json_string(True))
+                        buffer.write("\n")
+                        drain(buffer, f, SNAPSHOT_BUFFER_SIZE)
+                    for record in raw.values():
+                        if not isinstance(record, str):
+                            record = json.dumps(record, default=json_default)
+                        buffer.write(record if record.endswith("\n")
+                                     else record + "\n")
+                        drain(buffer, f, SNAPSHOT_BUFFER_SIZE)
+                else:
+                    # same output as json.dump of an {id: record} dict
+                    separator = "{"
+                    for obj in objs:
+                        buffer.write(separator)
+                        buffer.write(json.dumps(obj.id))
+                        buffer.write(": ")
+                        buffer.write(obj.to_json_string(True))
+                        separator = ", "
+                        drain(buffer, f, SNAPSHOT_BUFFER_SIZE)
+                    for obj_id, record in raw.items():
+                        if isinstance(record, str):
+                            record = json.loads(record)
+                        buffer.write(separator)
+                        buffer.write(json.dumps(obj_id))
+                        buffer.write(": ")
+                        buffer.write(json.dumps(record,
+                                                default=json_default))
+                        separator = ", "
+                        drain(buffer, f, SNAPSHOT_BUFFER_SIZE)
+                    buffer.write("{}" if separator == "{" else "}")
+                drain(buffer, f)
+                synced = cls.fsync_due(file_path)
+                if synced:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, file_path)
+        except BaseException:
+            buffer.seek(0)
+            buffer.truncate()
+            if path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        if synced:
+            fsync_directory(file_path)
+        else:
+            cls.defer_fsync(file_path)
+
+    @classmethod
+    def fsync_due(cls, file_path: str) -> bool:
+        """ Tell whether a write to file_path must be synced to disk:
+        always, never, or when batched at most once every
+        fsync_interval seconds per file
+        """
+        if cls.fsync_policy not in FSYNC_POLICIES:
+            raise ValueError("unknown fsync policy {}".format(
+                cls.fsync_policy))
+        if cls.fsync_policy == "always":
+            return True
+        if cls.fsync_policy == "never":
+            return False
+        now = time.monotonic()
+        with FSYNC_LOCK:
+            if now - LAST_FSYNC.get(file_path, float('-inf')) < \
+                    cls.fsync_interval:
+                return False
+            LAST_FSYNC[file_path] = now
+        return True
+
+    @classmethod
+    def defer_fsync(cls, file_path: str):
+        """ Once a write to file_path was left unsynced by the batched
+        policy, make sure a timer syncs it at most fsync_interval
+        seconds after the last sync
+        """
+        if cls.fsync_policy != "batched":
+            return
+        with FSYNC_LOCK:
+            if file_path in FSYNC_TIMERS:
+                return
+            delay = LAST_FSYNC.get(file_path, float('-inf')) + \
+                cls.fsync_interval - time.monotonic()
+            timer = threading.Timer(max(delay, 0), deferred_fsync,
+                                    (file_path,))
+            timer.daemon = True
+            FSYNC_TIMERS[file_path] = timer
+            timer.start()
+
+    @classmethod
+    def journal_paths(cls) -> Tuple[str, str]:
+        """ Return the live journal and the one being compacted
+        """
+        journal_path = ".db_{}.journal".format(cls.__name__)
+        return journal_path, journal_path + ".old"
+
+    @classmethod
+    def replay_journal(cls, journal_path: str):
+        """ Apply every entry of a journal file to DATA
+        """
+        if not path.exists(journal_path):
+            return
+        objs = DATA[cls.__name__]
+        raw = RAW.setdefault(cls.__name__, {})
+        with open(journal_path, 'rb+') as f:
+            offset = 0
+            for line in f:
+                try:
+                    entries = journal_entries(line)
+                except ValueError:
+                    if line.endswith(b"\n"):
+                        raise ValueError("corrupt entry in {} at byte {}"
+                                         .format(journal_path, offset))
+                    # torn final line from an interrupted append: cut
+                    # it off so the next append starts on a clean line
+                    f.truncate(offset)
+                    break
+                offset += len(line)
+                if not line.endswith(b"\n"):
+                    # final entry cut just before its newline: end it
+                    # so the next append does not get glued onto it
+                    f.write(b"\n")
+                for entry in entries:
+                    raw.pop(entry["id"], None)
+                    if entry["op"] == "save":
+                        objs[entry["id"]] = cls(**entry["obj"])
+                    elif entry["op"] == "remove":
+                        objs.pop(entry["id"], None)
+
+    @classmethod
+    def append_journal(cls, entries: List[dict]):
+        """ Append entries to the journal in one write, starting a
+        background compaction once journal_compact_threshold entries
+        piled up
+        """
+        s_class = cls.__name__
+        lines = "".join(json.dumps(entry) + "\n" for entry in entries)
+        with JOURNAL_LOCK:
+            with open(cls.journal_paths()[0], 'a') as f:
+                f.write(lines)
+                synced = cls.fsync_due(cls.journal_paths()[0])
+                if synced:
+                    f.flush()
+                    os.fsync(f.fileno())
+            if not synced:
+                cls.defer_fsync(cls.journal_paths()[0])
+            state = JOURNALS.setdefault(s_class, {"entries": 0,
+                                                  "compacting": False})
+            state["entries"] += len(entries)
+            if state["entries"] < cls.journal_compact_threshold \
+                    or state["compacting"]:
+                return
+            state["compacting"] = True
+        threading.Thread(target=cls.compact, daemon=True).start()
+
+    @classmethod
+    def persist(cls, entries: List[dict]):
+        """ Persist changes at once: appended to the journal or written
+        with a full snapshot, right away or, in write-behind mode,
+        by the flusher within write_behind_interval seconds
+        """
+        if not entries:
+            return
+        if cls.write_behind_interval > 0:
+            cls.mark_dirty(entries)
+        elif cls.storage_mode == "journal":
+            cls.append_journal(entries)
+        else:
+            cls.save_to_file()
+
+    @classmethod
+    def mark_dirty(cls, entries: List[dict]):
+        """ Queue changes for the write-behind flusher, waking it
+        early once write_behind_max_dirty objects are dirty
+        """
+        s_class = cls.__name__
+        with FLUSH_CONDITION:
+            DIRTY_CLASSES[s_class] = cls
+            dirty = DIRTY.setdefault(s_class, {})
+            for entry in entries:
+                dirty.pop(entry["id"], None)
+                dirty[entry["id"]] = entry
+            start_flusher()
+            if len(dirty) >= cls.write_behind_max_dirty:
+                FLUSH_CONDITION.notify()
+
+    @classmethod
+    def flush(cls):
+        """ Write out pending write-behind changes, of every
+        class when called on Base, of cls only otherwise
+        """
+        with FLUSH_CONDITION:
+            if cls is Base:
+                s_classes = list(DIRTY.keys())
+            else:
+                s_classes = [cls.__name__]
+        for s_class in s_classes:
+            klass = DIRTY_CLASSES.get(s_class)
+            if klass is None:
+                continue
+            with klass.store_lock().files:
+                with FLUSH_CONDITION:
+                    entries = DIRTY.pop(s_class, None)
+                if not entries:
+                    continue
+                if klass.storage_mode == "journal":
+                    klass.append_journal(list(entries.values()))
+                else:
+                    klass.save_to_file()
+
+    @classmethod
+    def compact(cls):
+        """ Fold the journal into a new snapshot. The journal is set
+        aside under the lock, so saves carry on into a fresh one while
+        the snapshot is written; replaying it again is harmless since
+        entries hold whole objects, so a crash at any point is safe
+        """
+        s_class = cls.__name__
+        file_path = cls.snapshot_path()
+        journal_path, old_path = cls.journal_paths()
+        with COMPACT_LOCK:
+            with JOURNAL_LOCK, cls.store_lock().read():
+                objs = list(DATA[s_class].values())
+                raw = dict(RAW.get(s_class, {}))
+                if path.exists(journal_path):
+                    if path.exists(old_path):
+                        with open(journal_path, 'r') as src, \
+                                open(old_path, 'a') as dst:
+                            dst.write(src.read())
+                        os.remove(journal_path)
+                    else:
+                        os.replace(journal_path, old_path)
+                JOURNALS[s_class] = {"entries": 0, "compacting": True}
+
+            cls.write_snapshot(file_path, objs, raw)
+
+            with JOURNAL_LOCK:
+                if path.exists(old_path):
+                    os.remove(old_path)
+                JOURNALS[s_class]["compacting"] = False
 
     def save(self):
         """ Save current object
         """
-        s_class = self.__class__.__name__
         self.updated_at = datetime.utcnow()
-        DATA[s_class][self.id] = self
-        self.__class__.save_to_file()
+        self.__class__.storage().save(self)
 
     def remove(self):
         """ Remove object
         """
-        s_class = self.__class__.__name__
-        if DATA[s_class].get(self.id) is not None:
-            del DATA[s_class][self.id]
-            self.__class__.save_to_file()
+        self.__class__.storage().remove(self)
+
+    @classmethod
+    def save_many(cls, objs: Iterable[TypeVar('Base')]):
+        """ Save objects at once: indexes are updated and the
+        store is persisted once for all of them
+        """
+        objs = list(objs)
+        now = datetime.utcnow()
+        for obj in objs:
+            obj.updated_at = now
+        cls.storage().save_all(cls, objs)
+
+    @classmethod
+    def remove_many(cls, ids: Iterable[str]) -> List[str]:
+        """ Remove objects by ID at once, persisting the store once;
+        returns the IDs that were found and removed
+        """
+        return cls.storage().remove_all(cls, list(dict.fromkeys(ids)))
 
     @classmethod
     def count(cls) -> int:
         """ Count all objects
         """
-        s_class = cls.__name__
-        return len(DATA[s_class].keys())
+        return cls.storage().count(cls)
 
     @classmethod
     def all(cls) -> Iterable[TypeVar('Base')]:
@@ -118,20 +1001,120 @@ class Base():
     def get(cls, id: str) -> TypeVar('Base'):
         """ Return one object by ID
         """
+        return cls.storage().get(cls, id)
+
+    @classmethod
+    def rebuild_indexes(cls):
+        """ Rebuild the declared indexes from the stored objects
+        """
         s_class = cls.__name__
-        return DATA[s_class].get(id)
+        with cls.store_lock().write():
+            indexes = [HashIndex(attribute)
+                       for attribute in cls.indexed_attributes]
+            indexes += [SortedIndex(attribute)
+                        for attribute in cls.sorted_attributes]
+            objs = list(DATA.get(s_class, {}).values())
+            for index in indexes:
+                if isinstance(index, SortedIndex):
+                    index.build(objs)
+                    continue
+                for obj in objs:
+                    index.add(obj)
+            INDEXES[s_class] = indexes
+            ORDERS[s_class] = sorted(DATA.get(s_class, {}).keys() |
+                                     RAW.get(s_class, {}).keys())
 
     @classmethod
-    def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
-        """ Search all objects with matching attributes
+    def index(cls, obj: TypeVar('Base')):
+        """ Refresh the declared indexes for one stored object
+        """
+        s_class = cls.__name__
+        if s_class not in INDEXES:
+            cls.rebuild_indexes()
+            return
+        with cls.store_lock().write():
+            for index in INDEXES[s_class]:
+                index.add(obj)
+            order = ORDERS[s_class]
+            position = bisect.bisect_left(order, obj.id)
+            if position == len(order) or order[position] != obj.id:
+                order.insert(position, obj.id)
+
+    @classmethod
+    def unindex(cls, obj_id: str):
+        """ Drop a removed object from the declared indexes
+        and the ID order
         """
         s_class = cls.__name__
+        if s_class not in INDEXES:
+            return
+        with cls.store_lock().write():
+            for index in INDEXES[s_class]:
+                index.discard(obj_id)
+            order = ORDERS[s_class]
+            position = bisect.bisect_left(order, obj_id)
+            if position < len(order) and order[position] == obj_id:
+                del order[position]
+
+    @classmethod
+    def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
+        """ Search all objects with matching attributes among
+        the candidates returned by the storage backend; a value may
+        be a Condition (Range, In, Prefix) instead of an exact one
+        """
         def _search(obj):
             if len(attributes) == 0:
                 return True
             for k, v in attributes.items():
-                if (getattr(obj, k) != v):
+                if not matches(v, getattr(obj, k)):
                     return False
             return True
         
-        return list(filter(_search, DATA[s_class].values()))
+        objs = cls.storage().candidates(cls, attributes)
+        return list(filter(_search, objs))
+
+    @classmethod
+    def iter(cls, attributes: dict = {}, after_id: str = None,
+             limit: int = None) -> Iterator[TypeVar('Base')]:
+        """ Lazily yield objects with matching attributes in ID
+        order: the ones after after_id, at most limit of them
+        """
+        if limit is not None and limit <= 0:
+            return
+        for obj in cls.storage().ordered(cls, attributes, after_id):
+            if all(matches(v, getattr(obj, k))
+                   for k, v in attributes.items()):
+                yield obj
+                if limit is not None:
+                    limit -= 1
+                    if limit == 0:
+                        return
+
+
+def to_datetime(value) -> datetime:
+    """ Parse a TIMESTAMP_FORMAT string, without going through
+    strptime when it has the usual length, passing datetimes
+    (as loaded from binary snapshots) through
+    """
+    if type(value) is datetime:
+        return value
+    if len(value) != 19 or value[10] != 'T':
+        return datetime.strptime(value, TIMESTAMP_FORMAT)
+    return datetime(int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                    int(value[11:13]), int(value[14:16]), int(value[17:19]))
+
+
+def json_default(value) -> str:
+    """ Encode the datetimes of records loaded from binary
+    snapshots when writing them as JSON
+    """
+    if type(value) is datetime:
+        return value.strftime(TIMESTAMP_FORMAT)
+    raise TypeError("{} is not JSON serializable".format(
+        type(value).__name__))
+
+
+STORAGES = {"json": FileStorage()}
+
+if Base.write_behind_interval > 0:
+    start_flusher()
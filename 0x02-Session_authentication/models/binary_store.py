@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+""" Columnar binary snapshot format module
+
+Layout, little-endian:
+  - header: magic, format version, record count, field count
+  - field dictionary: per field its name and column type
+  - one column per field, in dictionary order
+
+Column types:
+  - UUID: a state byte per record, 16 bytes per UUID string
+  - HEX: a state byte per record, 32 bytes per 64 digit hex string
+  - TIMESTAMP: epoch seconds of a width picked per column, for
+    columns of datetimes, and of the fields the caller declares as
+    timestamps, which may mix datetimes and TIMESTAMP_FORMAT strings
+  - STRING, JSON: a length per record (code points, of a width picked
+    per column), then the UTF-8 bytes of all the strings, or of the
+    JSON text of values that are not strings
+
+A record missing a field, or holding None for it, is marked by the
+state byte, a negative length or a reserved timestamp
+"""
+from array import array
+from datetime import datetime, timedelta
+from itertools import accumulate
+from typing import BinaryIO, Iterable, List, Tuple
+import calendar
+import json
+import re
+import struct
+import sys
+import uuid
+
+
+MAGIC = b'BASEBIN\x00'
+VERSION = 1
+HEADER = struct.Struct('<8sHIH')
+FIELD = struct.Struct('<HB')
+COLUMN = struct.Struct('<cQ')
+UUID, HEX, TIMESTAMP, STRING, JSON = range(5)
+PRESENT, NONE, ABSENT = range(3)
+EPOCH = datetime(1970, 1, 1)
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+TIMESTAMP_PATTERN = re.compile(r'\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d')
+UUID_PATTERN = re.compile('[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-'
+                          '[0-9a-f]{4}-[0-9a-f]{12}')
+HEX_PATTERN = re.compile('[0-9a-f]{64}')
+MISSING = object()
+
+
+def to_epoch(value) -> int:
+    """ Epoch seconds of a datetime or TIMESTAMP_FORMAT string
+    """
+    if type(value) is datetime:
+        return calendar.timegm(value.utctimetuple())
+    return calendar.timegm((int(value[0:4]), int(value[5:7]),
+                            int(value[8:10]), int(value[11:13]),
+                            int(value[14:16]), int(value[17:19])))
+
+
+def column_type(values: List, timestamp: bool = False) -> int:
+    """ Pick the most compact column type fitting every value;
+    strings are only read as timestamps in a timestamp field
+    """
+    present = [value for value in values
+               if value is not MISSING and value is not None]
+    if timestamp and all(type(value) is datetime or (
+            type(value) is str and len(value) == 19 and
+            TIMESTAMP_PATTERN.fullmatch(value)) for value in present):
+        return TIMESTAMP
+    if all(type(value) is str for value in present):
+        if present and all(len(value) == 36 and UUID_PATTERN.fullmatch(value)
+                           for value in present):
+            return UUID
+        if present and all(len(value) == 64 and HEX_PATTERN.fullmatch(value)
+                           for value in present):
+            return HEX
+        return STRING
+    if all(type(value) is datetime for value in present):
+        return TIMESTAMP
+    return JSON
+
+
+def little_endian(data: array) -> bytes:
+    """ Bytes of an array in little-endian order
+    """
+    if sys.byteorder == 'big':
+        data = array(data.typecode, data)
+        data.byteswap()
+    return data.tobytes()
+
+
+def from_little_endian(typecode: str, data: bytes) -> array:
+    """ Array of typecode read from little-endian bytes
+    """
+    result = array(typecode)
+    result.frombytes(data)
+    if sys.byteorder == 'big':
+        result.byteswap()
+    return result
+
+
+def smallest(typecodes: str, low: int, high: int) -> str:
+    """ First typecode whose items hold every value in [low, high]
+    """
+    for typecode in typecodes:
+        bits = array(typecode).itemsize * 8
+        if typecode.isupper():
+            if low >= 0 and high < 2 ** bits:
+                return typecode
+        elif -2 ** (bits - 1) <= low and high < 2 ** (bits - 1):
+            return typecode
+    raise ValueError("value out of range")
+
+
+def encode_column(kind: int, values: List) -> Tuple[str, bytes]:
+    """ Return the typecode and bytes of one column
+    """
+    if kind in (UUID, HEX):
+        states = array('B', (ABSENT if value is MISSING else
+                             NONE if value is None else PRESENT
+                             for value in values))
+        present = [value for value in values
+                   if value is not MISSING and value is not None]
+        if kind == UUID:
+            data = b''.join(uuid.UUID(value).bytes for value in present)
+        else:
+            data = bytes.fromhex(''.join(present))
+        return 'B', states.tobytes() + data
+
+    if kind == TIMESTAMP:
+        epochs = [to_epoch(value) for value in values
+                  if value is not MISSING and value is not None]
+        typecode = smallest('Iq', min(epochs, default=0),
+                            max(epochs, default=0) + 2)
+        top = 2 ** 32 - 1 if typecode == 'I' else 2 ** 63 - 1
+        column = array(typecode, (top - 1 if value is MISSING else
+                                  top if value is None else to_epoch(value)
+                                  for value in values))
+        return typecode, little_endian(column)
+
+    texts = [value if kind == STRING or value is None or value is MISSING
+             else json.dumps(value) for value in values]
+    lengths = [-2 if text is MISSING else -1 if text is None else len(text)
+               for text in texts]
+    typecode = smallest('bhiq', -2, max(lengths, default=0))
+    data = ''.join(text for text in texts
+                   if text is not MISSING and text is not None)
+    return typecode, little_endian(array(typecode, lengths)) + data.encode()
+
+
+def decode_column(kind: int, typecode: str, count: int,
+                  data: memoryview) -> Tuple[List, bool]:
+    """ Return the values of one column and whether
+    some records miss the field
+    """
+    if kind in (UUID, HEX):
+        states = data[:count].tobytes()
+        text = data[count:].hex()
+        if states == bytes([PRESENT]) * count:
+            if kind == HEX:
+                return [text[i:i + 64]
+                        for i in range(0, count * 64, 64)], False
+            return ["{}-{}-{}-{}-{}".format(
+                text[i:i + 8], text[i + 8:i + 12], text[i + 12:i + 16],
+                text[i + 16:i + 20], text[i + 20:i + 32])
+                for i in range(0, count * 32, 32)], False
+        values = []
+        position = 0
+        for state in states:
+            if state != PRESENT:
+                values.append(None if state == NONE else MISSING)
+            elif kind == UUID:
+                digits = text[position:position + 32]
+                values.append("{}-{}-{}-{}-{}".format(
+                    digits[:8], digits[8:12], digits[12:16], digits[16:20],
+                    digits[20:]))
+                position += 32
+            else:
+                values.append(text[position:position + 64])
+                position += 64
+        return values, ABSENT in states
+
+    if kind == TIMESTAMP:
+        top = 2 ** 32 - 1 if typecode == 'I' else 2 ** 63 - 1
+        epochs = from_little_endian(typecode, data)
+        # records saved together share their timestamps
+        datetimes = {epoch: EPOCH + timedelta(seconds=epoch)
+                     for epoch in set(epochs) - {top - 1, top}}
+        datetimes[top - 1] = MISSING
+        datetimes[top] = None
+        return [datetimes[epoch] for epoch in epochs], top - 1 in epochs
+
+    width = array(typecode).itemsize
+    lengths = from_little_endian(typecode, data[:count * width])
+    text = bytes(data[count * width:]).decode()
+    if kind == STRING and min(lengths, default=0) >= 0:
+        ends = list(accumulate(lengths))
+        return [text[end - length:end]
+                for end, length in zip(ends, lengths)], False
+    values = []
+    position = 0
+    for length in lengths:
+        if length < 0:
+            values.append(None if length == -1 else MISSING)
+            continue
+        value = text[position:position + length]
+        values.append(value if kind == STRING else json.loads(value))
+        position += length
+    return values, -2 in lengths
+
+
+def dump(records: Iterable[dict], f: BinaryIO,
+         timestamp_fields: Tuple[str, ...] = ()):
+    """ Write records, dictionaries or JSON strings, to f; the values
+    of timestamp_fields come back as datetimes
+    """
+    records = [json.loads(record) if isinstance(record, str) else record
+               for record in records]
+    names = list(dict.fromkeys(name for record in records
+                               for name in record))
+    f.write(HEADER.pack(MAGIC, VERSION, len(records), len(names)))
+    columns = []
+    for name in names:
+        values = [record.get(name, MISSING) for record in records]
+        kind = column_type(values, name in timestamp_fields)
+        encoded = name.encode()
+        f.write(FIELD.pack(len(encoded), kind) + encoded)
+        columns.append(encode_column(kind, values))
+    for typecode, data in columns:
+        f.write(COLUMN.pack(typecode.encode(), len(data)))
+        f.write(data)
+
+
+def load(f: BinaryIO) -> List[Tuple[str, dict]]:
+    """ Read the (id, record) pairs of a snapshot from f;
+    timestamps come back as datetime objects
+    """
+    data = memoryview(f.read())
+    magic, version, count, field_count = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("not a binary snapshot")
+    if version > VERSION:
+        raise ValueError("unsupported binary snapshot version {}".format(
+            version))
+    offset = HEADER.size
+    fields = []
+    for _ in range(field_count):
+        size, kind = FIELD.unpack_from(data, offset)
+        offset += FIELD.size
+        fields.append((bytes(data[offset:offset + size]).decode(), kind))
+        offset += size
+    columns = []
+    sparse = False
+    for name, kind in fields:
+        typecode, size = COLUMN.unpack_from(data, offset)
+        offset += COLUMN.size
+        values, missing = decode_column(kind, typecode.decode(), count,
+                                        data[offset:offset + size])
+        columns.append(values)
+        sparse = sparse or missing
+        offset += size
+    names = [name for name, _ in fields]
+    if not sparse:
+        records = [dict(zip(names, row)) for row in zip(*columns)]
+    else:
+        records = [{name: value for name, value in zip(names, row)
+                    if value is not MISSING} for row in zip(*columns)]
+    return [(record["id"], record) for record in records]
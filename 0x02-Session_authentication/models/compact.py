@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+""" Compact records module: Base subclasses without a per-instance
+__dict__, holding their fields in one packed bytes object
+"""
+from datetime import datetime, timedelta
+from os import getenv
+import calendar
+import json
+import re
+import struct
+import time
+import uuid
+
+from models.base import Base, DATA, TIMESTAMP_FORMAT
+
+COMPACT_RECORDS = getenv("BASE_COMPACT_RECORDS", "") == "1"
+EPOCH = datetime(1970, 1, 1)
+PACKED_TIMESTAMPS = struct.Struct('<II')
+HEX_DIGEST = re.compile('[0-9a-f]{64}')
+
+
+def to_epoch(value: datetime) -> int:
+    """ Convert a naive UTC datetime to epoch seconds
+    """
+    return calendar.timegm(value.utctimetuple())
+
+
+def parse_epoch(value: str) -> int:
+    """ Convert a TIMESTAMP_FORMAT string to epoch seconds
+    without going through strptime; datetimes are converted as is
+    """
+    if type(value) is datetime:
+        return to_epoch(value)
+    if len(value) != 19:
+        return to_epoch(datetime.strptime(value, TIMESTAMP_FORMAT))
+    return calendar.timegm((int(value[0:4]), int(value[5:7]),
+                            int(value[8:10]), int(value[11:13]),
+                            int(value[14:16]), int(value[17:19])))
+
+
+def pack_record(created_at: int, updated_at: int, values: list) -> bytes:
+    """ Pack timestamps and field values in one bytes object: two
+    uint32 epochs, then per value a tag byte and its payload. Strings
+    are length-prefixed UTF-8, except hex digests which are stored
+    as raw bytes; anything else falls back to JSON
+    """
+    parts = [PACKED_TIMESTAMPS.pack(created_at, updated_at)]
+    for value in values:
+        if value is None:
+            parts.append(b'\x00')
+        elif type(value) is str and len(value) == 64 \
+                and HEX_DIGEST.fullmatch(value):
+            parts.append(b'\x02' + bytes.fromhex(value))
+        else:
+            if type(value) is str:
+                tag, data = b'\x01', value.encode()
+            else:
+                tag, data = b'\x03', json.dumps(value).encode()
+            if len(data) < 255:
+                parts.append(tag + bytes((len(data),)) + data)
+            else:
+                parts.append(tag + b'\xff' + struct.pack('<I', len(data)) +
+                             data)
+    return b''.join(parts)
+
+
+def unpack_record(packed: bytes, stop: int = None) -> list:
+    """ Unpack the field values of a packed record,
+    only the first stop ones when given
+    """
+    values = []
+    offset = PACKED_TIMESTAMPS.size
+    while offset < len(packed) and (stop is None or len(values) < stop):
+        tag = packed[offset]
+        offset += 1
+        if tag == 0:
+            values.append(None)
+            continue
+        if tag == 2:
+            values.append(packed[offset:offset + 32].hex())
+            offset += 32
+            continue
+        size = packed[offset]
+        offset += 1
+        if size == 255:
+            size = struct.unpack_from('<I', packed, offset)[0]
+            offset += 4
+        data = packed[offset:offset + size].decode()
+        offset += size
+        values.append(data if tag == 1 else json.loads(data))
+    return values
+
+
+class PackedField():
+    """ Descriptor reading and writing one field of a packed record
+    """
+
+    def __init__(self, index: int):
+        """ Initialize the descriptor of the field at index
+        """
+        self.index = index
+
+    def __get__(self, obj, owner=None):
+        """ Decode the field
+        """
+        if obj is None:
+            return self
+        return unpack_record(obj._packed, self.index + 1)[self.index]
+
+    def __set__(self, obj, value):
+        """ Re-pack the record with the new value, unless unchanged
+        """
+        values = unpack_record(obj._packed)
+        if values[self.index] == value \
+                and type(values[self.index]) is type(value):
+            return
+        values[self.index] = value
+        obj._packed = pack_record(*PACKED_TIMESTAMPS.unpack_from(
+            obj._packed), values)
+
+
+class CompactBase(Base):
+    """ Base class for compact records: no per-instance __dict__,
+    subclasses list their record_fields and every value, timestamps
+    included as epoch seconds, is packed in a single bytes object
+    """
+
+    __slots__ = ('id', '_packed')
+    __setattr__ = object.__setattr__
+
+    def __init_subclass__(cls, **kwargs):
+        """ Install a packed field descriptor per record field
+        """
+        super().__init_subclass__(**kwargs)
+        for index, field in enumerate(cls.record_fields):
+            setattr(cls, field, PackedField(index))
+
+    def __init__(self, *args: list, **kwargs: dict):
+        """ Initialize a compact instance, packing every
+        record field found in kwargs at once
+        """
+        s_class = str(self.__class__.__name__)
+        DATA.setdefault(s_class, {})
+
+        self.id = kwargs['id'] if 'id' in kwargs else str(uuid.uuid4())
+        now = int(time.time())
+        created_at = kwargs.get('created_at')
+        updated_at = kwargs.get('updated_at')
+        self._packed = pack_record(
+            now if created_at is None else parse_epoch(created_at),
+            now if updated_at is None else parse_epoch(updated_at),
+            [kwargs.get(field) for field in self.record_fields])
+
+    @property
+    def created_at(self) -> datetime:
+        """ Getter of the creation date
+        """
+        return EPOCH + timedelta(
+            seconds=PACKED_TIMESTAMPS.unpack_from(self._packed)[0])
+
+    @created_at.setter
+    def created_at(self, value: datetime):
+        """ Setter of the creation date
+        """
+        updated_at = PACKED_TIMESTAMPS.unpack_from(self._packed)[1]
+        self._packed = PACKED_TIMESTAMPS.pack(to_epoch(value), updated_at) \
+            + self._packed[PACKED_TIMESTAMPS.size:]
+
+    @property
+    def updated_at(self) -> datetime:
+        """ Getter of the last update date
+        """
+        return EPOCH + timedelta(
+            seconds=PACKED_TIMESTAMPS.unpack_from(self._packed)[1])
+
+    @updated_at.setter
+    def updated_at(self, value: datetime):
+        """ Setter of the last update date
+        """
+        created_at = PACKED_TIMESTAMPS.unpack_from(self._packed)[0]
+        self._packed = PACKED_TIMESTAMPS.pack(created_at, to_epoch(value)) \
+            + self._packed[PACKED_TIMESTAMPS.size:]
+
+    def json_cache(self) -> dict:
+        """ Compact records cache nothing, the point is their size
+        """
+        return {}
+
+    def to_json(self, for_serialization: bool = False) -> dict:
+        """ Convert the object a JSON dictionary, with the
+        same keys and order as a regular record
+        """
+        created_at, updated_at = PACKED_TIMESTAMPS.unpack_from(self._packed)
+        result = {
+            'id': self.id,
+            'created_at': time.strftime(TIMESTAMP_FORMAT,
+                                        time.gmtime(created_at)),
+            'updated_at': time.strftime(TIMESTAMP_FORMAT,
+                                        time.gmtime(updated_at)),
+        }
+        values = unpack_record(self._packed)
+        for field, value in zip(self.record_fields, values):
+            if not for_serialization and field[0] == '_':
+                continue
+            result[field] = value
+        return result
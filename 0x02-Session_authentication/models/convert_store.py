@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+""" Convert a model store between on-disk formats
+
+Usage: python3 -m models.convert_store <Class> <from> <to>
+"""
+import sys
+from models.user import User
+
+
+CLASSES = {"User": User}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] not in CLASSES:
+        print("Usage: python3 -m models.convert_store "
+              "<{}> <from> <to>".format("|".join(CLASSES)))
+        sys.exit(1)
+    cls = CLASSES[sys.argv[1]]
+    cls.convert_store(sys.argv[2], sys.argv[3])
+    print("{} objects: {} -> {}".format(cls.count(),
+                                        cls.snapshot_path(sys.argv[2]),
+                                        cls.snapshot_path(sys.argv[3])))
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+""" Query conditions and in-memory indexes module
+"""
+from typing import Iterable, List, Tuple, TypeVar
+import bisect
+
+
+class Condition():
+    """ Query condition on one attribute, given as its value
+    in the attributes of Base.search or Base.iter
+    """
+
+    def matches(self, value) -> bool:
+        """ Tell whether an attribute value meets the condition
+        """
+        raise NotImplementedError()
+
+
+class Range(Condition):
+    """ low <= value < high, either bound being optional
+    """
+
+    def __init__(self, low=None, high=None):
+        """ Initialize the bounds
+        """
+        self.low = low
+        self.high = high
+
+    def matches(self, value) -> bool:
+        """ Tell whether value is within the bounds
+        """
+        if value is None:
+            return False
+        try:
+            return (self.low is None or self.low <= value) and \
+                (self.high is None or value < self.high)
+        except TypeError:
+            return False
+
+
+class In(Condition):
+    """ value is one of values
+    """
+
+    def __init__(self, values: Iterable):
+        """ Initialize the accepted values
+        """
+        self.values = list(values)
+
+    def matches(self, value) -> bool:
+        """ Tell whether value is accepted
+        """
+        return value in self.values
+
+
+class Prefix(Condition):
+    """ value is a string starting with prefix
+    """
+
+    def __init__(self, prefix: str):
+        """ Initialize the prefix
+        """
+        self.prefix = prefix
+
+    def matches(self, value) -> bool:
+        """ Tell whether value starts with the prefix
+        """
+        return type(value) is str and value.startswith(self.prefix)
+
+
+def matches(expected, value) -> bool:
+    """ Tell whether an attribute value meets what a search
+    asks for: a Condition, or else an equal value
+    """
+    if isinstance(expected, Condition):
+        return expected.matches(value)
+    return value == expected
+
+
+class Top():
+    """ Sorts after anything, to bound sorted index keys
+    """
+
+    def __lt__(self, other) -> bool:
+        """ Never less
+        """
+        return False
+
+    def __gt__(self, other) -> bool:
+        """ Always greater
+        """
+        return True
+
+
+TOP = Top()
+
+
+class SortedIndex():
+    """ Ordered index on the value of one attribute: a key array
+    of (type name, value, ID) searched with bisect, in step with
+    an array of the objects; serves equality, Range, In and Prefix.
+    Values of different types are kept apart by their type name,
+    None is not indexed
+    """
+
+    def __init__(self, attribute: str):
+        """ Initialize an empty index on attribute
+        """
+        self.attribute = attribute
+        self.keys = []
+        self.objs = []
+        self.values = {}
+
+    @staticmethod
+    def key(value, obj_id='') -> tuple:
+        """ Return the sort key of a value
+        """
+        return (type(value).__name__, value, obj_id)
+
+    def add(self, obj: TypeVar('Base')):
+        """ Index obj under its current value, moving it
+        if it was indexed under another one
+        """
+        value = getattr(obj, self.attribute, None)
+        key = self.key(value, obj.id)
+        if self.values.get(obj.id) == key:
+            self.objs[bisect.bisect_left(self.keys, key)] = obj
+            return
+        self.discard(obj.id)
+        if value is None:
+            return
+        try:
+            position = bisect.bisect_left(self.keys, key)
+        except TypeError:
+            # not comparable with the other values of its type
+            return
+        self.keys.insert(position, key)
+        self.objs.insert(position, obj)
+        self.values[obj.id] = key
+
+    def build(self, objs: List[TypeVar('Base')]):
+        """ Index objs in one sort rather than one insertion each
+        """
+        entries = []
+        for obj in objs:
+            value = getattr(obj, self.attribute, None)
+            if value is not None:
+                entries.append((self.key(value, obj.id), obj))
+        try:
+            entries.sort(key=lambda entry: entry[0])
+        except TypeError:
+            for obj in objs:
+                self.add(obj)
+            return
+        self.keys = [key for key, _ in entries]
+        self.objs = [obj for _, obj in entries]
+        self.values = {obj.id: key for key, obj in entries}
+
+    def discard(self, obj_id: str):
+        """ Drop obj_id from the index
+        """
+        key = self.values.pop(obj_id, None)
+        if key is None:
+            return
+        position = bisect.bisect_left(self.keys, key)
+        del self.keys[position]
+        del self.objs[position]
+
+    def bounds(self, condition) -> List[Tuple[int, int]]:
+        """ Return the slices of the arrays holding the values
+        meeting condition, None when the index can't tell
+        """
+        try:
+            if isinstance(condition, In):
+                return [bound for value in dict.fromkeys(condition.values)
+                        for bound in self.bounds(value)]
+            if isinstance(condition, Prefix):
+                prefix = condition.prefix
+                start = bisect.bisect_left(self.keys, ('str', prefix))
+                if not prefix:
+                    end = bisect.bisect_left(self.keys, ('str', TOP))
+                else:
+                    end = bisect.bisect_left(self.keys, (
+                        'str', prefix[:-1] + chr(ord(prefix[-1]) + 1)))
+                return [(start, end)]
+            if isinstance(condition, Range):
+                bound = condition.low if condition.low is not None \
+                    else condition.high
+                if bound is None:
+                    return None
+                name = type(bound).__name__
+                start = bisect.bisect_left(self.keys, (name,)) \
+                    if condition.low is None \
+                    else bisect.bisect_left(self.keys, (name, condition.low))
+                end = bisect.bisect_left(self.keys, (name, TOP)) \
+                    if condition.high is None \
+                    else bisect.bisect_left(self.keys, (name, condition.high))
+                return [(start, max(start, end))]
+            if isinstance(condition, Condition) or condition is None:
+                return None
+            name = type(condition).__name__
+            return [(bisect.bisect_left(self.keys, (name, condition)),
+                     bisect.bisect_left(self.keys, (name, condition, TOP)))]
+        except (TypeError, ValueError):
+            return None
+
+    def estimate(self, condition) -> int:
+        """ Return how many objects select would return,
+        None when the index can't serve condition
+        """
+        bounds = self.bounds(condition)
+        if bounds is None:
+            return None
+        return sum(end - start for start, end in bounds)
+
+    def select(self, condition) -> List[TypeVar('Base')]:
+        """ Return the objects meeting condition
+        """
+        return [obj for start, end in self.bounds(condition)
+                for obj in self.objs[start:end]]
+
+
+class HashIndex():
+    """ Equality index from the value of one attribute to the
+    objects holding it: the object itself while it is the only
+    one, as for unique attributes like emails, a dict by ID once
+    several objects share the value
+    """
+
+    def __init__(self, attribute: str):
+        """ Initialize an empty index on attribute
+        """
+        self.attribute = attribute
+        self.entries = {}
+        self.values = {}
+
+    def add(self, obj: TypeVar('Base')):
+        """ Index obj under its current value, moving it
+        if it was indexed under another one
+        """
+        value = getattr(obj, self.attribute, None)
+        try:
+            hash(value)
+        except TypeError:
+            self.discard(obj.id)
+            return
+        if obj.id in self.values:
+            if self.values[obj.id] == value:
+                entry = self.entries[value]
+                if type(entry) is dict:
+                    entry[obj.id] = obj
+                else:
+                    self.entries[value] = obj
+                return
+            self.discard(obj.id)
+        entry = self.entries.get(value)
+        if entry is None:
+            self.entries[value] = obj
+        elif type(entry) is dict:
+            entry[obj.id] = obj
+        else:
+            self.entries[value] = {entry.id: entry, obj.id: obj}
+        self.values[obj.id] = value
+
+    def discard(self, obj_id: str):
+        """ Drop obj_id from the index
+        """
+        if obj_id not in self.values:
+            return
+        value = self.values.pop(obj_id)
+        entry = self.entries[value]
+        if type(entry) is not dict:
+            del self.entries[value]
+            return
+        del entry[obj_id]
+        if len(entry) == 1:
+            self.entries[value] = next(iter(entry.values()))
+
+    def lookup(self, value) -> Iterable[TypeVar('Base')]:
+        """ Return the objects indexed under value
+        """
+        try:
+            entry = self.entries.get(value)
+        except TypeError:
+            return None
+        if entry is None:
+            return ()
+        return entry.values() if type(entry) is dict else (entry,)
+
+    def estimate(self, condition) -> int:
+        """ Return how many objects select would return, None
+        when the index can't serve condition: only equality and In
+        """
+        if isinstance(condition, In):
+            try:
+                values = dict.fromkeys(condition.values)
+            except TypeError:
+                # unhashable values: leave them to a scan
+                return None
+            counts = [self.estimate(value) for value in values]
+            return None if None in counts else sum(counts)
+        if isinstance(condition, Condition):
+            return None
+        objs = self.lookup(condition)
+        return None if objs is None else len(objs)
+
+    def select(self, condition) -> List[TypeVar('Base')]:
+        """ Return the objects meeting condition
+        """
+        if isinstance(condition, In):
+            return [obj for value in dict.fromkeys(condition.values)
+                    for obj in self.lookup(value)]
+        return list(self.lookup(condition))
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+""" SQLite storage backend module
+"""
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterable, Iterator, List, Tuple, TypeVar
+import os
+import sqlite3
+import threading
+
+from models.base import Storage, TIMESTAMP_FORMAT
+from models.query import Condition, In, Prefix, Range
+
+
+COLUMN_TYPES = (str, int, float, type(None))
+MAX_PARAMS = 500
+CHUNK = 256
+
+
+class SQLiteStorage(Storage):
+    """ Objects stored in a SQLite database in WAL mode, shared by
+    every process: one table per class holding each object as JSON,
+    plus one indexed column per attribute in indexed_attributes
+    and sorted_attributes
+    """
+
+    def __init__(self, file_path: str, timeout: float = 30.0):
+        """ Initialize a backend on the database at file_path; writers
+        wait up to timeout seconds for the database to be free
+        """
+        self.file_path = file_path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._tables = set()
+
+    def connection(self) -> sqlite3.Connection:
+        """ Return the connection of the calling thread, opening one
+        when there is none yet or the process was forked since
+        """
+        if getattr(self._local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.file_path,
+                                         timeout=self.timeout,
+                                         isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    @contextmanager
+    def transaction(self):
+        """ Run the block in one write transaction
+        """
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def table(self, cls: type) -> str:
+        """ Create the table of cls, its indexed columns and their
+        indexes when missing, and return its quoted name
+        """
+        name = '"{}"'.format(cls.__name__)
+        if cls.__name__ in self._tables:
+            return name
+        with self._lock, self.transaction() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS {} "
+                               "(id TEXT PRIMARY KEY, data TEXT NOT NULL)"
+                               .format(name))
+            columns = {row[1] for row in connection.execute(
+                "PRAGMA table_info({})".format(name))}
+            for attribute in self.columns(cls):
+                if attribute not in columns:
+                    connection.execute('ALTER TABLE {} ADD COLUMN "{}"'
+                                       .format(name, attribute))
+                    connection.execute(
+                        'UPDATE {} SET "{}" = json_extract(data, ?)'
+                        .format(name, attribute), ("$." + attribute,))
+                connection.execute(
+                    'CREATE INDEX IF NOT EXISTS "{}_{}" ON {} ("{}")'
+                    .format(cls.__name__, attribute, name, attribute))
+            self._tables.add(cls.__name__)
+        return name
+
+    @staticmethod
+    def columns(cls: type) -> Tuple[str, ...]:
+        """ Return the attributes of cls stored in indexed columns
+        """
+        return tuple(dict.fromkeys(cls.indexed_attributes +
+                                   cls.sorted_attributes))
+
+    @staticmethod
+    def column_value(value):
+        """ Return value as stored in a column: timestamps in their
+        JSON form, NULL for values SQLite cannot compare like Python
+        """
+        if type(value) is datetime:
+            return value.strftime(TIMESTAMP_FORMAT)
+        return value if type(value) in COLUMN_TYPES else None
+
+    def row(self, obj: TypeVar('Base')) -> tuple:
+        """ Return the id, JSON and indexed column values of obj
+        """
+        values = [obj.id, obj.to_json_string(True)]
+        for attribute in self.columns(obj.__class__):
+            values.append(self.column_value(getattr(obj, attribute, None)))
+        return tuple(values)
+
+    def upsert(self, cls: type) -> str:
+        """ Return the statement inserting or updating one row of cls
+        """
+        columns = ["id", "data"] + ['"{}"'.format(attribute) for attribute
+                                    in self.columns(cls)]
+        return "INSERT INTO {} ({}) VALUES ({}) ON CONFLICT(id) DO " \
+            "UPDATE SET {}".format(
+                self.table(cls), ", ".join(columns),
+                ", ".join("?" * len(columns)),
+                ", ".join("{0} = excluded.{0}".format(column)
+                          for column in columns[1:]))
+
+    @classmethod
+    def conditions(cls, model: type, attributes: dict) -> Tuple[list, list]:
+        """ Return SQL conditions and parameters on the indexed columns
+        of model selecting at least the objects matching attributes;
+        the caller filters the rows on the exact attributes
+        """
+        conditions = []
+        params = []
+        columns = cls.columns(model)
+        for k, v in attributes.items():
+            if k not in columns:
+                continue
+            column = '"{}"'.format(k)
+            if isinstance(v, In):
+                if len(v.values) > MAX_PARAMS or any(
+                        value is not None and cls.column_value(value) is None
+                        for value in v.values):
+                    continue
+                values = [cls.column_value(value) for value in v.values
+                          if value is not None]
+                condition = "{} IN ({})".format(column,
+                                                ", ".join("?" * len(values)))
+                if None in v.values:
+                    condition = "({} OR {} IS NULL)".format(condition, column)
+                conditions.append(condition)
+                params.extend(values)
+            elif isinstance(v, Prefix):
+                if v.prefix:
+                    conditions.append("{} >= ?".format(column))
+                    params.append(v.prefix)
+                if v.prefix and ord(v.prefix[-1]) < 0x10ffff:
+                    conditions.append("{} < ?".format(column))
+                    params.append(v.prefix[:-1] + chr(ord(v.prefix[-1]) + 1))
+            elif isinstance(v, Range):
+                # <= on the upper bound: timestamps lose their
+                # microseconds in columns, the caller still filters
+                for bound, operator in ((v.low, ">="), (v.high, "<=")):
+                    if bound is not None and \
+                            cls.column_value(bound) is not None:
+                        conditions.append("{} {} ?".format(column, operator))
+                        params.append(cls.column_value(bound))
+            elif isinstance(v, Condition):
+                continue
+            elif v is None:
+                conditions.append("{} IS NULL".format(column))
+            elif cls.column_value(v) is not None:
+                conditions.append("{} = ?".format(column))
+                params.append(cls.column_value(v))
+        return conditions, params
+
+    def load(self, cls: type):
+        """ Make sure the table of cls exists
+        """
+        self.table(cls)
+
+    def save(self, obj: TypeVar('Base')):
+        """ Insert or update the row of obj
+        """
+        cls = obj.__class__
+        self.connection().execute(self.upsert(cls), self.row(obj))
+
+    def save_all(self, cls: type, objs: List[TypeVar('Base')]):
+        """ Insert or update the rows of objs in one transaction
+        """
+        statement = self.upsert(cls)
+        with self.transaction() as connection:
+            connection.executemany(statement, map(self.row, objs))
+
+    def remove(self, obj: TypeVar('Base')):
+        """ Delete the row of obj
+        """
+        self.connection().execute("DELETE FROM {} WHERE id = ?".format(
+            self.table(obj.__class__)), (obj.id,))
+
+    def remove_all(self, cls: type, obj_ids: List[str]) -> List[str]:
+        """ Delete the rows with obj_ids in one transaction
+        and return the IDs that were found
+        """
+        table = self.table(cls)
+        removed = []
+        with self.transaction() as connection:
+            for start in range(0, len(obj_ids), MAX_PARAMS):
+                chunk = obj_ids[start:start + MAX_PARAMS]
+                marks = ", ".join("?" * len(chunk))
+                found = {row[0] for row in connection.execute(
+                    "SELECT id FROM {} WHERE id IN ({})".format(table, marks),
+                    chunk)}
+                connection.execute("DELETE FROM {} WHERE id IN ({})".format(
+                    table, marks), chunk)
+                removed.extend(obj_id for obj_id in chunk if obj_id in found)
+        return removed
+
+    def get(self, cls: type, obj_id: str) -> TypeVar('Base'):
+        """ Return one object by ID
+        """
+        row = self.connection().execute(
+            "SELECT data FROM {} WHERE id = ?".format(self.table(cls)),
+            (obj_id,)).fetchone()
+        return None if row is None else cls.from_record(row[0])
+
+    def candidates(self, cls: type,
+                   attributes: dict) -> Iterable[TypeVar('Base')]:
+        """ Return the objects whose indexed columns match
+        attributes, in insertion order
+        """
+        conditions, params = self.conditions(cls, attributes)
+        statement = "SELECT data FROM {}".format(self.table(cls))
+        if conditions:
+            statement += " WHERE " + " AND ".join(conditions)
+        rows = self.connection().execute(statement + " ORDER BY rowid",
+                                         params)
+        return [cls.from_record(row[0]) for row in rows]
+
+    def ordered(self, cls: type, attributes: dict,
+                after_id: str = None) -> Iterator[TypeVar('Base')]:
+        """ Yield the objects whose indexed columns match attributes
+        in ID order, starting after after_id, one chunk at a time
+        """
+        conditions, params = self.conditions(cls, attributes)
+        statement = "SELECT id, data FROM {} WHERE {}id > ? ORDER BY id " \
+            "LIMIT {}".format(self.table(cls), "".join(
+                condition + " AND " for condition in conditions), CHUNK)
+        after_id = "" if after_id is None else after_id
+        while True:
+            rows = self.connection().execute(
+                statement, params + [after_id]).fetchall()
+            for row in rows:
+                yield cls.from_record(row[1])
+            if len(rows) < CHUNK:
+                return
+            after_id = rows[-1][0]
+
+    def count(self, cls: type) -> int:
+        """ Count the rows of cls
+        """
+        return self.connection().execute("SELECT COUNT(*) FROM {}".format(
+            self.table(cls))).fetchone()[0]
@@ -1,14 +1,28 @@
 #!/usr/bin/env python3
 """ User module
 """
+from itertools import islice
+from typing import Callable, Iterable, List, Tuple
+from os import getenv
 import hashlib
+import time
 from models.base import Base
+from models.compact import CompactBase, COMPACT_RECORDS
 
 
-class User(Base):
+class User(CompactBase if COMPACT_RECORDS else Base):
     """ User class
     """
 
+    if COMPACT_RECORDS:
+        __slots__ = ()
+    record_fields = ('email', '_password', 'first_name', 'last_name')
+    indexed_attributes = ('email',)
+    # sorted indexes cost memory per user: opt in with e.g.
+    # USER_SORTED_ATTRIBUTES=created_at,updated_at
+    sorted_attributes = tuple(attribute for attribute in getenv(
+        "USER_SORTED_ATTRIBUTES", "").split(",") if attribute)
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a User instance
         """
@@ -43,6 +57,47 @@ class User(Base):
         pwd_e = pwd.encode()
         return hashlib.sha256(pwd_e).hexdigest().lower() == self.password
 
+    @classmethod
+    def import_users(cls, users: Iterable[Tuple[str, str]],
+                     chunk_size: int = 1000,
+                     report: Callable[[dict], None] = None) -> List[dict]:
+        """ Create many users from (email, password) pairs, writing
+        the store once per chunk instead of once per user.
+        Pairs with a missing or already used email, or no password,
+        are skipped. Returns (and passes to report) the stats of each
+        chunk: users created, skipped, seconds and users per second
+        """
+        emails = {user.email for user in cls.all()}
+        users = iter(users)
+        stats = []
+        while True:
+            chunk = list(islice(users, chunk_size))
+            if not chunk:
+                break
+            start = time.perf_counter()
+            created = []
+            for email, pwd in chunk:
+                if not email or email in emails \
+                        or pwd is None or type(pwd) is not str:
+                    continue
+                user = cls(email=email)
+                user.password = pwd
+                emails.add(email)
+                created.append(user)
+            cls.save_many(created)
+            elapsed = time.perf_counter() - start
+            chunk_stats = {
+                "chunk": len(stats),
+                "users": len(created),
+                "skipped": len(chunk) - len(created),
+                "seconds": elapsed,
+                "users_per_sec": len(created) / elapsed if elapsed else 0.0,
+            }
+            stats.append(chunk_stats)
+            if report is not None:
+                report(chunk_stats)
+        return stats
+
     def display_name(self) -> str:
         """ Display User name based on email/first_name/last_name
         """
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+""" Stress test of the Base store: writer threads create, update
+and delete their own users while reader threads search, list and
+count them; the store in memory and reloaded from file must hold
+every last update and none of the deleted users. The run starts from
+a store of seeded users reloaded from file, so lazily loaded records
+are mixed with new objects
+
+Usage: ./stress_store.py [writers] [users per writer]
+"""
+import os
+import sys
+import tempfile
+import threading
+
+
+def writer(number: int, count: int, expected: dict, errors: list):
+    """ Create count users, update each one three times
+    and delete every third one
+    """
+    from models.user import User
+
+    try:
+        users = []
+        for i in range(count):
+            user = User(email="w{}u{}@example.com".format(number, i))
+            user.password = "pwd"
+            user.save()
+            users.append(user)
+        for version in range(3):
+            for user in users:
+                user.last_name = "v{}".format(version)
+                user.save()
+        for i, user in enumerate(users):
+            if i % 3 == 0:
+                user.remove()
+            else:
+                expected[user.id] = user.to_json(True)
+    except Exception as e:
+        errors.append(e)
+
+
+def reader(done: threading.Event, errors: list):
+    """ Search, list and count users until the writers are done
+    """
+    from models.user import User
+
+    try:
+        while not done.is_set():
+            for user in User.all():
+                User.search({'email': user.email})
+                break
+            User.count()
+            User.search({'last_name': "v2"})
+    except Exception as e:
+        errors.append(e)
+
+
+def check(expected: dict) -> list:
+    """ Compare the store in memory and on file with expected
+    """
+    from models.base import Base
+    from models.user import User
+
+    problems = []
+    for label in ("memory", "file"):
+        if label == "file":
+            Base.flush()
+            User.load_from_file()
+        if User.count() != len(expected):
+            problems.append("{}: {} users instead of {}".format(
+                label, User.count(), len(expected)))
+        for user_id, obj in expected.items():
+            user = User.get(user_id)
+            if user is None:
+                problems.append("{}: lost user {}".format(label, user_id))
+            elif user.to_json(True)["last_name"] != obj["last_name"]:
+                problems.append("{}: lost update of {}".format(
+                    label, user_id))
+            elif User.search({'email': obj["email"]}) != [user]:
+                problems.append("{}: index out of date for {}".format(
+                    label, user_id))
+    return problems
+
+
+if __name__ == "__main__":
+    writers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 60
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(tempfile.mkdtemp())
+    from models.base import Base
+    from models.user import User
+    User.load_from_file()
+
+    expected = {}
+    seeded = [User(email="seed{}@example.com".format(i), last_name="s")
+              for i in range(count)]
+    User.save_many(seeded)
+    Base.flush()
+    User.load_from_file()
+    expected.update((user.id, user.to_json(True)) for user in seeded)
+    # saved while the seeded records may still be unbuilt
+    first = User(email="first@example.com", last_name="f")
+    first.save()
+    expected[first.id] = first.to_json(True)
+    errors = []
+    done = threading.Event()
+    readers = [threading.Thread(target=reader, args=(done, errors))
+               for _ in range(4)]
+    threads = [threading.Thread(target=writer,
+                                args=(i, count, expected, errors))
+               for i in range(writers)]
+    for thread in readers + threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    done.set()
+    for thread in readers:
+        thread.join()
+
+    problems = [repr(e) for e in errors] + check(expected)
+    for problem in problems[:20]:
+        print(problem)
+    print("{} writers x {} users: {}".format(
+        writers, count, "FAILED" if problems else "OK"))
+    sys.exit(1 if problems else 0)
@@ -3,10 +3,18 @@
 Route module for the API
 """
 from flask import Flask, jsonify, request, abort, redirect, url_for
+from os import getenv
 from auth import Auth
 
 
-AUTH = Auth()
+hash_service = None
+if getenv("AUTH_HASH_WORKERS"):
+    from auth import _hash_password, _check_password
+    from hash_service import HashService
+    hash_service = HashService(_hash_password, _check_password,
+                               int(getenv("AUTH_HASH_WORKERS")),
+                               int(getenv("AUTH_HASH_QUEUE", 0)) or None)
+AUTH = Auth(hash_service)
 app = Flask(__name__)
 
 
@@ -4,14 +4,46 @@ module to handle authentication
 """
 from flask import jsonify
 from bcrypt import hashpw, gensalt, checkpw
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
+from os import getenv
 from sqlalchemy.exc import NoResultFound
-from typing import Union
+from typing import Callable, Iterable, List, Tuple, Union
 from uuid import uuid4
+import os
+import threading
+import time
 
 from db import DB
+from hash_service import HashService
 from user import User
 
 
+def _bcrypt_rounds() -> int:
+    """
+    Returns the bcrypt cost policy, read from AUTH_BCRYPT_ROUNDS.
+
+    Returns:
+        int: The configured cost, 12 (bcrypt's default) when unset.
+    """
+    return int(getenv("AUTH_BCRYPT_ROUNDS", 12))
+
+
+def _needs_rehash(hashed_password: Union[bytes, str]) -> bool:
+    """
+    Tells whether a hash was made with a cost other than the policy.
+
+    Args:
+        hashed_password (bytes): A bcrypt hash, "$2b$<cost>$...".
+
+    Returns:
+        bool: True if the hash cost differs from _bcrypt_rounds().
+    """
+    if isinstance(hashed_password, str):
+        hashed_password = hashed_password.encode("utf-8")
+    return int(hashed_password.split(b"$")[2]) != _bcrypt_rounds()
+
+
 def _hash_password(password: str) -> str:
     """
     Hashes a given plaintext password using the bcrypt hashing algorithm.
@@ -26,13 +58,27 @@ def _hash_password(password: str) -> str:
     password = password.encode("utf-8")
 
     # Use bcrypt's hashpw function to hash the password with a
-    # randomly generated salt
-    hashed_pwd = hashpw(password, gensalt())
+    # randomly generated salt at the configured cost
+    hashed_pwd = hashpw(password, gensalt(_bcrypt_rounds()))
 
     # Return the hashed password as bytes
     return hashed_pwd
 
 
+def _check_password(password: str, hashed_password: bytes) -> bool:
+    """
+    Checks a plaintext password against a bcrypt hash.
+
+    Args:
+        password (str): The plaintext password to check.
+        hashed_password (bytes): The stored bcrypt hash.
+
+    Returns:
+        bool: True if the password matches the hash.
+    """
+    return checkpw(password.encode("utf-8"), hashed_password)
+
+
 def _generate_uuid() -> str:
     """
     return a string representation of a new UUID
@@ -43,8 +89,48 @@ def _generate_uuid() -> str:
 class Auth:
     """Auth class to interact with the authentication database."""
 
-    def __init__(self):
+    def __init__(self, hash_service: HashService = None):
+        """
+        Args:
+            hash_service (HashService): Optional process pool that
+            runs bcrypt off the calling thread; hashing runs inline
+            when it is None.
+        """
         self._db = DB()
+        self._hash_service = hash_service
+        self._rehash_queue = ThreadPoolExecutor(max_workers=1,
+                                                thread_name_prefix="rehash")
+        # queued rehashes hold plaintext passwords: keep at most
+        # AUTH_REHASH_QUEUE of them, later logins retry the others
+        self._rehash_slots = threading.BoundedSemaphore(
+            int(getenv("AUTH_REHASH_QUEUE", 100)))
+
+    def _hash(self, password: str) -> bytes:
+        """Hash a password, in the hash service when there is one."""
+        if self._hash_service is None:
+            return _hash_password(password)
+        return self._hash_service.hash(password)
+
+    def _check(self, password: str, hashed_password: bytes) -> bool:
+        """Check a password, in the hash service when there is one."""
+        if self._hash_service is None:
+            return _check_password(password, hashed_password)
+        return self._hash_service.check(password, hashed_password)
+
+    def _rehash(self, user_id: int, password: str,
+                old_hash: bytes) -> None:
+        """
+        Hash a password at the current cost and store it, unless the
+        stored hash is no longer old_hash (the password was reset in
+        the meantime). Runs on the rehash thread, so it writes through
+        a session of its own rather than the one request threads use.
+        """
+        try:
+            self._db.update_user_in_own_session(
+                user_id, {"hashed_password": old_hash},
+                hashed_password=self._hash(password))
+        finally:
+            self._rehash_slots.release()
 
     def register_user(self, email: str, password: str) -> Union[None, User]:
         """
@@ -85,13 +171,72 @@ class Auth:
         except NoResultFound:
             # If no user with the provided email is found,
             # proceed to register the new user
-            hashed_password = _hash_password(password)
+            hashed_password = self._hash(password)
             new_user = self._db.add_user(email, hashed_password)
             return new_user
         else:
             # If a user with the same email exists, raise an error
             raise ValueError("User {} already exists".format(email))
 
+    def register_users(self, users: Iterable[Tuple[str, str]],
+                       chunk_size: int = 1000, workers: int = None,
+                       report: Callable[[dict], None] = None) -> List[dict]:
+        """
+        Registers many users, hashing their passwords on every core.
+
+        Args:
+            users (Iterable[Tuple[str, str]]): (email, password) pairs.
+            chunk_size (int): Users hashed and inserted per chunk.
+            workers (int): Hashing processes, one per core when None.
+            report (Callable): Called with the stats of each chunk.
+
+        Returns:
+            List[dict]: Per-chunk stats: users inserted, skipped
+            (already registered, duplicated or invalid), seconds
+            and users per second.
+
+        Note:
+            Each chunk is written with a single DB.add_users call.
+        """
+        stats = []
+        users = iter(users)
+        seen = set()
+        workers = workers or os.cpu_count() or 1
+        chunksize = max(1, chunk_size // (workers * 4))
+        with ProcessPoolExecutor(workers) as pool:
+            while True:
+                chunk = list(islice(users, chunk_size))
+                if not chunk:
+                    break
+                start = time.perf_counter()
+                valid = []
+                for email, password in chunk:
+                    if not email or not isinstance(email, str) \
+                            or not password or not isinstance(password, str) \
+                            or email in seen:
+                        continue
+                    seen.add(email)
+                    valid.append((email, password))
+                known = self._db.existing_emails([e for e, _ in valid])
+                valid = [(e, p) for e, p in valid if e not in known]
+                hashes = pool.map(_hash_password, [p for _, p in valid],
+                                  chunksize=chunksize)
+                self._db.add_users([
+                    {"email": email, "hashed_password": hashed}
+                    for (email, _), hashed in zip(valid, hashes)])
+                elapsed = time.perf_counter() - start
+                chunk_stats = {
+                    "chunk": len(stats),
+                    "users": len(valid),
+                    "skipped": len(chunk) - len(valid),
+                    "seconds": elapsed,
+                    "users_per_sec": len(valid) / elapsed if elapsed else 0.0,
+                }
+                stats.append(chunk_stats)
+                if report is not None:
+                    report(chunk_stats)
+        return stats
+
     def valid_login(self, email: str, password: str) -> bool:
         """
         Validate a user's login credentials.
@@ -112,10 +257,16 @@ class Auth:
             existing_user = self._db.find_user_by(email=email)
 
             if existing_user:
-                # Encode the password as bytes
-                password = password.encode("utf-8")
                 # Compare hashed passwords
-                valid_pwd = checkpw(password, existing_user.hashed_password)
+                valid_pwd = self._check(password,
+                                        existing_user.hashed_password)
+                # Move hashes made under an older cost policy to the
+                # current one without holding up the login
+                if valid_pwd and _needs_rehash(existing_user.hashed_password) \
+                        and self._rehash_slots.acquire(blocking=False):
+                    self._rehash_queue.submit(self._rehash, existing_user.id,
+                                              password,
+                                              existing_user.hashed_password)
                 # Return True if passwords match
                 return valid_pwd
         except NoResultFound:
@@ -186,7 +337,7 @@ class Auth:
     def update_password(self, reset_token: str, password: str) -> None:
         try:
             user = self._db.find_user_by(reset_token=reset_token)
-            hashed_password = _hash_password(password)
+            hashed_password = self._hash(password)
             self._db.update_user(user.id, hashed_password=hashed_password)
             self._db.update_user(user.id, reset_token=None)
             return user.reset_token
@@ -2,6 +2,7 @@
 
 """DB module
 """
+from contextlib import contextmanager
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
@@ -9,6 +10,7 @@ from sqlalchemy.orm.session import Session
 from user import User, Base
 from sqlalchemy.exc import InvalidRequestError
 from sqlalchemy.orm.exc import NoResultFound
+from typing import Iterator, List, Set
 
 
 class DB:
@@ -29,6 +31,23 @@ class DB:
             self.__session = DBSession()
         return self.__session
 
+    @contextmanager
+    def _new_session(self) -> Iterator[Session]:
+        """
+        Short-lived session of its own, for threads other than the
+        one using the memoized session: a Session is not thread-safe.
+        Commits when the block ends, rolls back if it raises.
+        """
+        session = sessionmaker(bind=self._engine)()
+        try:
+            yield session
+            session.commit()
+        except BaseException:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
     def add_user(self, email: str, hashed_password: str) -> User:
         """
         Add a new user to the database.
@@ -52,6 +71,38 @@ class DB:
         # Return the newly created User object
         return new_user
 
+    def add_users(self, users: List[dict]) -> List[User]:
+        """
+        Add many users to the database in a single commit.
+
+        Args:
+            users (List[dict]): One dict of column values per user,
+            each with at least email and hashed_password.
+
+        Returns:
+            List[User]: The newly created User objects.
+        """
+        new_users = [User(**user) for user in users]
+        self._session.add_all(new_users)
+        self._session.commit()
+        return new_users
+
+    def existing_emails(self, emails: List[str]) -> Set[str]:
+        """
+        Find which of the given emails already belong to a user.
+
+        Args:
+            emails (List[str]): The email addresses to look up.
+
+        Returns:
+            Set[str]: The subset of emails already registered.
+        """
+        if not emails:
+            return set()
+        rows = self._session.query(User.email).filter(
+            User.email.in_(emails))
+        return {row[0] for row in rows}
+
     def find_user_by(self, **kwargs) -> User:
         """
         Find a user in the database based on the provided keyword arguments.
@@ -111,7 +162,34 @@ class DB:
 
                 # Update the user's attribute with the new value (v)
                 setattr(user, k, v)
-                return None
 
             # Commit the changes to the database
             self._session.commit()
+
+    def update_user_in_own_session(self, user_id: int, expected: dict,
+                                   **kwargs) -> bool:
+        """
+        Update a user like update_user, in a session of its own so it
+        can run on a background thread, and only while the stored
+        values of the columns in expected are still those values.
+
+        Args:
+            user_id (int): The ID of the user to be updated.
+            expected (dict): Column values the row must still hold.
+            **kwargs: Fields and their new values.
+
+        Returns:
+            bool: True if the user was updated, False if it is gone or
+            one of the expected columns changed.
+
+        Raises:
+            ValueError: If a field does not exist on the user object.
+        """
+        for k in list(expected) + list(kwargs):
+            if not hasattr(User, k):
+                raise ValueError
+        with self._new_session() as session:
+            updated = session.query(User).filter_by(
+                id=user_id, **expected).update(
+                    kwargs, synchronize_session=False)
+        return updated == 1
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Concurrency check of the background rehash: logins that queue
+rehashes run while the calling thread keeps registering users, so
+the rehash thread writes while the shared session is in use. Every
+register_user call must succeed and every rehashed password must be
+stored at the new cost. A password reset landing before its queued
+rehash runs must not be undone by it.
+
+Usage: ./stress_rehash.py [logins] [registrations]
+"""
+import os
+import sys
+import tempfile
+import threading
+
+
+def main(logins: int, registrations: int) -> list:
+    """
+    Run the check and return the problems found.
+    """
+    from auth import Auth, _hash_password
+    from user import User
+
+    os.environ["AUTH_BCRYPT_ROUNDS"] = "4"
+    auth = Auth()
+    for i in range(logins):
+        auth.register_user("old{}@example.com".format(i), "pwd{}".format(i))
+
+    os.environ["AUTH_BCRYPT_ROUNDS"] = "5"
+    problems = []
+    for i in range(max(logins, registrations)):
+        try:
+            if i < logins and not auth.valid_login(
+                    "old{}@example.com".format(i), "pwd{}".format(i)):
+                problems.append("login {} refused".format(i))
+            if i < registrations:
+                auth.register_user("new{}@example.com".format(i), "pwd")
+        except Exception as e:
+            problems.append(repr(e))
+
+    # hold the rehash thread so the reset lands before the rehash
+    release = threading.Event()
+    auth._rehash_queue.submit(release.wait)
+    auth.register_user("reset@example.com", "old")
+    os.environ["AUTH_BCRYPT_ROUNDS"] = "6"
+    auth.valid_login("reset@example.com", "old")
+    user = auth._db.find_user_by(email="reset@example.com")
+    auth._db.update_user(user.id, hashed_password=_hash_password("new"))
+    release.set()
+    auth._rehash_queue.shutdown(wait=True)
+    if not auth.valid_login("reset@example.com", "new") or \
+            auth.valid_login("reset@example.com", "old"):
+        problems.append("reset undone by a rehash")
+
+    with auth._db._new_session() as session:
+        for i in range(logins):
+            user = session.query(User).filter_by(
+                email="old{}@example.com".format(i)).one()
+            if not auth._check("pwd{}".format(i), user.hashed_password):
+                problems.append("old{}: wrong hash".format(i))
+            elif user.hashed_password.startswith(b"$2b$04$"):
+                problems.append("old{}: not rehashed".format(i))
+        stored = session.query(User).filter(
+            User.email.like("new%")).count()
+    if stored != registrations:
+        problems.append("{} users registered instead of {}".format(
+            stored, registrations))
+    return problems
+
+
+if __name__ == "__main__":
+    logins = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    registrations = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(tempfile.mkdtemp())
+    problems = main(logins, registrations)
+    for problem in problems[:20]:
+        print(problem)
+    print("{} logins x {} registrations: {}".format(
+        logins, registrations, "FAILED" if problems else "OK"))
+    sys.exit(1 if problems else 0)